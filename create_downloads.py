@@ -1,17 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import codecs
 import collections
+import gzip
+import hashlib
 import json
 import os
 import re
+import shutil
+import sys
+import threading
 import traceback
 
 from contextlib import contextmanager
 from datetime import datetime
-from itertools import chain, izip, product
-from tempfile import NamedTemporaryFile
+from htmlentitydefs import name2codepoint
+from itertools import chain, imap, izip
+from tempfile import NamedTemporaryFile, TemporaryFile
 from os.path import abspath, basename, dirname, join
+from Queue import Queue
 
 import lxml.html
 import requests
@@ -23,9 +31,58 @@ import scraperwiki
 # how many rows to request from the SQL API at any one time
 PAGE_SIZE = 5000
 
+# name given to the rowid of each row when paging through a table by rowid
+ROWID_COLUMN = "_sdt_rowid"
+
+# how many tables to fetch from the SQL API at once
+FETCH_WORKERS = 4
+
+# how many fetched pages may be waiting per table before its worker blocks
+PREFETCH_PAGES = 2
+
+# (connect, read) timeouts in seconds for requests to the box
+HTTP_TIMEOUT = (10, 300)
+
+# how many bytes to read from a response at a time.
+# Note: this happens to be the size that lxml.etree.iterparse uses when
+#       parsing file-like objects.
+CHUNK_SIZE = 32 * 1024
+
+# whether to fetch, convert and write rows in separate threads
+PIPELINE = True
+
+# how many rows may be waiting between the stages of a pipelined write
+PIPELINE_DEPTH = 1000
+
+# how many span-free rows are written to a CSV file at once
+CSV_BATCH_ROWS = 1000
+
+# how many threads compress the sheets of the Excel workbook at once. As
+# many deflated sheets may be held in memory or temporary files while they
+# wait their turn.
+COMPRESS_WORKERS = 4
+
+# whether text in the Excel workbook goes in a table of shared strings,
+# which repeated category labels and the like are much smaller in
+SHARED_STRINGS = True
+
+# whether table fingerprints include a checksum of every value, which
+# notices edits that leave the row count and highest rowid alone. Taking it
+# reads every row of every table, albeit not into memory at once. Only then
+# are tables' rows cached, and appended to when that's all that changed.
+FINGERPRINT_CHECKSUM = False
+
+# whether to parse grids streamwise, rather than loading them whole. Grids
+# which aren't well-formed are loaded whole all the same.
+STREAMING_GRIDS = True
+
 # where to put the resulting output files
 DESTINATION = "./http"
 
+# where to keep the rows of exported tables, for appending to next time
+# given FINGERPRINT_CHECKSUM
+ROW_CACHE = "./row_cache"
+
 
 class DatasetIsEmptyError(Exception):
     pass
@@ -74,21 +131,73 @@ class GeneratorReader(object):
         return result
 
 
+# A cell which spans rows or columns, detached from its HTML document.
+SpanCell = collections.namedtuple("SpanCell", "rowspan colspan content")
+
+
+# Rows are sequences of cells. A row which is a tuple holds plain contents
+# only, none of which span, so the writers can skip their span handling.
+
+
 def get_cell_span_content(cell):
     """
-    Return the content and spanning of ``cell``, which may be a string or a
-    lxml HTML <td>
+    Return the content and spanning of ``cell``, which may be a string, a
+    ``SpanCell`` or a lxml <td>
     """
-    if isinstance(cell, lxml.html.HtmlElement):
+    if isinstance(cell, lxml.etree._Element):
         colspan = int(cell.attrib.get("colspan", 1))
         rowspan = int(cell.attrib.get("rowspan", 1))
-        content = cell.text_content()
+        content = get_cell_text(cell)
+    elif isinstance(cell, SpanCell):
+        rowspan, colspan, content = cell
     else:
         rowspan, colspan = 1, 1
         content = cell
     return (rowspan, colspan), content
 
 
+def get_cell_text(cell):
+    if len(cell) == 0:
+        # The common case, which needn't be serialized.
+        return cell.text or u""
+    return lxml.etree.tostring(cell, method="text", encoding=unicode,
+                               with_tail=False)
+
+
+def simplify_row(cells):
+    """
+    Return the text of the lxml ``cells`` as a tuple if none of them span,
+    or else ``cells`` as they are.
+    """
+    for cell in cells:
+        attrib = cell.attrib
+        if "colspan" in attrib or "rowspan" in attrib:
+            if (int(attrib.get("colspan", 1)) != 1 or
+                    int(attrib.get("rowspan", 1)) != 1):
+                return cells
+    return tuple([get_cell_text(cell) for cell in cells])
+
+
+def detach_row(row):
+    """
+    Return a copy of ``row`` in which lxml cells are replaced by their
+    content, or by a ``SpanCell`` if they span. The copy may outlive the
+    document the row came from.
+    """
+    if isinstance(row, tuple):
+        # Holds no lxml cells to begin with.
+        return row
+
+    detached = []
+    for cell in row:
+        (rowspan, colspan), content = get_cell_span_content(cell)
+        if rowspan == colspan == 1:
+            detached.append(content)
+        else:
+            detached.append(SpanCell(rowspan, colspan, content))
+    return detached
+
+
 class CsvOutput(object):
 
     def __init__(self, path):
@@ -96,16 +205,20 @@ class CsvOutput(object):
         self.tempfile = NamedTemporaryFile(dir=dirname(path), delete=False)
         self.writer = unicodecsv.writer(self.tempfile, encoding='utf-8')
 
-        # Row buffer for colspans.
-        self._buffer = []
+        # Cells which rowspans carry into the coming rows, as one
+        # {column: content} dict per row, nearest row first.
+        self._pending = collections.deque()
+
+        # How many columns the last row written had.
+        self._width = 0
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
 
-        # TODO(pwaller): Ensure that self._buffer is emptied
-        assert not self._buffer
+        # Like a browser, drop rowspans which reach past the last row.
+        self._pending.clear()
 
         self.tempfile.close()
 
@@ -123,70 +236,136 @@ class CsvOutput(object):
         # Abstracted so that self.writer implementation could be replaced.
         self.writer.writerow(row)
 
+    def _drop_placeholders(self, row, carried):
+        """
+        Return ``row`` without the empty cells which some grids have in the
+        columns ``carried`` into it by rowspans from above, or ``row`` as it
+        is if it leaves those columns out, as HTML does.
+
+        A row has placeholders if it is exactly as wide as the row before it
+        on its own, every carried column has an empty cell of its own, and
+        only empty cells follow the first of those. Dropping them then moves
+        no content, so a ragged row's genuinely empty cells aren't lost.
+        """
+        placeholders = set()
+        i = 0
+        for index, cell in enumerate(row):
+            (rowspan, colspan), content = get_cell_span_content(cell)
+            empty = rowspan == colspan == 1 and not content
+            if placeholders and not empty:
+                return row
+            if i in carried and empty:
+                placeholders.add(index)
+            i += colspan
+
+        if i != self._width or len(placeholders) != len(carried):
+            return row
+
+        return [cell for index, cell in enumerate(row)
+                if index not in placeholders]
+
     def write_row(self, row):
         """
-        Stream write ``row``, taking into account row/colspanning, buffering
-        rowspans into the future rows.
+        Stream write ``row``, taking into account row/colspanning, carrying
+        rowspans into the future rows. Empty placeholder cells under the
+        rowspans are replaced by the cells carried into them.
         """
 
-        if len(row) == 0:
-            return
+        pending = self._pending
 
-        def insert(rowidx, colidx, content):
-            """
-            Ensure that self._buffer is long enough to accomodate ``content``
-            at ``(row, col)``.
-            """
-            n_missing_rows = rowidx - len(self._buffer) + 1
-            if n_missing_rows > 0:
-                self._buffer.extend(list() for _ in xrange(n_missing_rows))
+        if not pending:
+            if isinstance(row, tuple):
+                if row:
+                    self._send_row(row)
+                    self._width = len(row)
+                return
 
-            row = self._buffer[rowidx]
-            n_missing_cells = colidx - len(row) + 1
-            if n_missing_cells > 0:
-                row.extend("" for _ in xrange(n_missing_cells))
+            if len(row) == 0:
+                return
 
-            row[colidx] = content
+        carried = pending.popleft() if pending else {}
+        if carried:
+            row = self._drop_placeholders(row, carried)
+        output_row = []
+
+        def fill_carried():
+            # Columns taken by rowspans from above come before the next cell.
+            while len(output_row) in carried:
+                output_row.append(carried.pop(len(output_row)))
 
-        i = 0
         for cell in row:
+            fill_carried()
             (rowspan, colspan), content = get_cell_span_content(cell)
 
-            if colspan == rowspan == 1:
-                insert(0, i, content)
-                i += 1
-                continue
-
-            # TODO(pwaller, drj): rowspans are too difficult to implement right
-            # at this second. You need to take account of rowspans impinging
-            # upon this row in order to get the correct value of ``i``.
-            assert rowspan < 2, "Not Implemented: Please report this."
+            i = len(output_row)
+            output_row.extend(content for _ in xrange(colspan))
 
-            # if rowspan > 1:
-            #     dbg()
+            if rowspan == 1:
+                continue
 
-            # Copy spanning content
-            for y, x in product(xrange(rowspan), xrange(colspan)):
-                insert(y, i + x, content)
+            while len(pending) < rowspan - 1:
+                pending.append({})
 
-            i += colspan
+            for y in xrange(rowspan - 1):
+                future = pending[y]
+                for x in xrange(colspan):
+                    future[i + x] = content
 
-        output_row, self._buffer = self._buffer[0], self._buffer[1:]
+        # Rowspans can also reach past the cells of this row. Any which
+        # overlap a colspan of this row lose out to it.
+        for column in sorted(carried):
+            if column >= len(output_row):
+                output_row.extend("" for _ in xrange(column - len(output_row)))
+                output_row.append(carried[column])
 
         self._send_row(output_row)
+        self._width = len(output_row)
 
     def write_rows(self, rows):
-        self.writer.writerows(rows)
+        """
+        Write the list ``rows``, in one go if none of them span.
+        """
+        if self._pending or not all(isinstance(row, tuple) for row in rows):
+            for row in rows:
+                self.write_row(row)
+            return
+
+        rows = [row for row in rows if row]
+        if rows:
+            self.writer.writerows(rows)
+            self._width = len(rows[-1])
 
 
 class ExcelOutput(object):
     MAX_ROWS = 65000
 
+    # Row number of the first row of a sheet.
+    FIRST_ROW = 0
+
     def __init__(self, path):
         self.workbook = xlwt.Workbook(encoding="utf-8")
         self.path = path
         # Either None or a string that is the error to report.
         self.encountered_error = None
+        # If set, the existing file at ``path`` is left alone.
+        self.discarded = False
+        # Names which sheets have, or are going to have, in lower case as
+        # Excel compares them.
+        self.sheet_names = set()
+
+    @property
+    def row_limit(self):
+        """
+        How many rows a sheet takes before further rows are refused.
+        """
+        return self.MAX_ROWS - self.FIRST_ROW + 1
+
+    def reserve_sheet_names(self, names):
+        """
+        Keep sheets added for overflowing rows from taking any of ``names``,
+        which sheets are going to be added under later.
+        """
+        self.sheet_names.update(name.lower() for name in names)
 
     def __enter__(self):
         return self
@@ -195,7 +374,7 @@ class ExcelOutput(object):
         if exc_type is not None:
             return
 
-        if self.encountered_error:
+        if self.encountered_error or self.discarded:
             return
 
         basepath = dirname(self.path)
@@ -210,10 +389,16 @@ class ExcelOutput(object):
                 os.chmod(self.path, 0644)
 
     def add_sheet(self, sheet_name):
+        """
+        Add a sheet called ``sheet_name``, returning a function which writes
+        a row to it. That function returns False once the sheet is full and
+        refuses any further rows, so that the caller can stop producing them.
+        """
         sheet = self.workbook.add_sheet(sheet_name)
+        self.sheet_names.add(sheet_name.lower())
 
         class State:
-            current_row = 0
+            current_row = self.FIRST_ROW
 
         def write_row(row):
 
@@ -226,9 +411,17 @@ class ExcelOutput(object):
                     log("{0} {1}"
                         .format(type(self).__name__, error_message))
                     self.encountered_error = error_message
-                return
+                return False
 
             j = State.current_row
+
+            if isinstance(row, tuple):
+                for i, content in enumerate(row):
+                    sheet.write(j, i, content)
+
+                State.current_row += 1
+                return True
+
             i = 0
 
             for cell in row:
@@ -244,44 +437,98 @@ class ExcelOutput(object):
                 i += colspan
 
             State.current_row += 1
+            return True
 
         return write_row
 
 
 import pyexcelerate
 import pyexcelerate.Range
-def excel_coord(row, col):
-    return pyexcelerate.Range.Range.coordinate_to_string((row, col))
 
 
 class ExceleratorOutput(ExcelOutput):
-    MAX_ROWS = 100000
+    MAX_ROWS = pyexcelerate.Range.Range.MAX_ROWS
+    FIRST_ROW = 1 # Note: PyExcelerate counts from 1.
+
+    # Whether rows past a full sheet go on to "name (2)", "name (3)", ...
+    # sheets, skipping any names other sheets have, rather than being
+    # refused.
+    CONTINUE_SHEETS = True
+
+    # Excel refuses longer sheet names.
+    MAX_SHEET_NAME = 31
 
     def __init__(self, path):
         self.path = path
-        self.workbook = pyexcelerate.Workbook()
+        self.workbook = pyexcelerate.Workbook(
+            compress_workers=COMPRESS_WORKERS,
+            shared_strings=SHARED_STRINGS)
         self.encountered_error = None
+        self.discarded = False
+        self.sheet_names = set()
+
+    @property
+    def row_limit(self):
+        if self.CONTINUE_SHEETS:
+            return None
+        return super(ExceleratorOutput, self).row_limit
+
+    def continuation_name(self, sheet_name, number):
+        """
+        Return the name of the first sheet after the ``number``th holding
+        ``sheet_name`` whose name isn't already taken by some other sheet,
+        along with its number.
+        """
+        while True:
+            number += 1
+            suffix = " ({0})".format(number)
+            name = sheet_name[:self.MAX_SHEET_NAME - len(suffix)] + suffix
+            if name.lower() not in self.sheet_names:
+                return name, number
 
     def add_sheet(self, sheet_name):
-        sheet = self.workbook.new_sheet(sheet_name)
+
+        def new_sheet(name):
+            self.sheet_names.add(name.lower())
+            return self.workbook.new_sheet(name, write_only=True)
 
         class State:
-            current_row = 1 # Note: PyExcelerate counts from 1.
+            sheet = new_sheet(sheet_name)
+            sheets = 1
+            current_row = self.FIRST_ROW
 
         def write_row(row):
 
             if State.current_row > self.MAX_ROWS:
-                if not self.encountered_error:
-                    error_message = (
-                      "Tried to write more than {0} rows, ceasing output"
-                      .format(self.MAX_ROWS)
-                    )
-                    log("{0} {1}"
-                        .format(type(self).__name__, error_message))
-                    self.encountered_error = error_message
-                return
+                if self.CONTINUE_SHEETS:
+                    State.sheet.flush()
+                    name, State.sheets = self.continuation_name(sheet_name,
+                                                                State.sheets)
+                    log("{0} continuing on sheet {1!r}"
+                        .format(type(self).__name__, name))
+                    State.sheet = new_sheet(name)
+                    State.current_row = self.FIRST_ROW
 
+                else:
+                    if not self.encountered_error:
+                        error_message = (
+                          "Tried to write more than {0} rows, ceasing output"
+                          .format(self.MAX_ROWS)
+                        )
+                        log("{0} {1}"
+                            .format(type(self).__name__, error_message))
+                        self.encountered_error = error_message
+                    return False
+
+            sheet = State.sheet
             j = State.current_row
+
+            if isinstance(row, tuple):
+                sheet.set_row_values(j, row)
+
+                State.current_row += 1
+                return True
+
             i = 1 # Note: PyExcelerate counts from 1.
 
             for cell in row:
@@ -289,16 +536,18 @@ class ExceleratorOutput(ExcelOutput):
                 sheet.set_cell_value(j, i, content)
 
                 if not (colspan == rowspan == 1):
-                    # It's a span.
+                    # It's a span. Those reaching past the end of the sheet
+                    # are cut short.
 
-                    top_left = excel_coord(j, i)
-                    bottom_right = excel_coord(j+rowspan-1, i+colspan-1)
+                    bottom_right = (min(j + rowspan - 1, self.MAX_ROWS),
+                                    i + colspan - 1)
 
-                    sheet.range(top_left, bottom_right).merge()
+                    sheet.range((j, i), bottom_right).merge()
 
                 i += colspan
 
             State.current_row += 1
+            return True
 
         return write_row
 
@@ -309,9 +558,168 @@ def main():
     generate_for_box(box_url)
 
 
-def paged_rows_generator(box_url, tables):
-    for table in tables:
-        yield get_paged_rows(box_url, table['name'])
+def paged_rows_generator(box_url, tables, workers=FETCH_WORKERS, limit=None):
+    """
+    Return one iterable of pages per table in ``tables``, in table order,
+    each fetching no more than ``limit`` rows. Tables marked by
+    ``plan_appends`` only have their rows after the cached ones fetched.
+
+    With ``workers`` > 1 the pages are fetched by a bounded pool of threads,
+    so that several tables are in flight at once. Each table only buffers up
+    to ``PREFETCH_PAGES`` pages ahead of the consumer.
+    """
+    def table_pages(table):
+        cached_rows, after = table.get('cached', (0, None))
+        table_limit = None if limit is None else max(limit - cached_rows, 0)
+        return get_paged_rows(box_url, table['name'], table['columns'],
+                              table_limit, after)
+
+    if workers <= 1:
+        return [table_pages(table) for table in tables]
+
+    channels = [Channel(PREFETCH_PAGES) for _ in tables]
+    tasks = Queue()
+    for table, channel in izip(tables, channels):
+        tasks.put((table, channel))
+
+    def fetch(table):
+        for page in table_pages(table):
+            # Pages have to be read here, in the worker, rather than lazily
+            # by the consumer. A response can't be left half read whilst its
+            # table waits its turn, or the box may drop the connection. So
+            # each table holds up to PREFETCH_PAGES + 1 whole pages of rows,
+            # rather than one row at a time as it does without workers.
+            yield list(page)
+
+    def worker():
+        while True:
+            table, channel = tasks.get()
+            if table is None:
+                return
+            channel.produce(fetch(table))
+
+    for _ in xrange(min(workers, len(tables))):
+        tasks.put((None, None))
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    return channels
+
+
+# Sentinel put onto a channel's queue when its producer is exhausted.
+_DONE = object()
+
+
+class _Failure(object):
+
+    """
+    Wraps the exception raised in a producer thread so that it can be
+    re-raised in the consumer.
+    """
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class Channel(object):
+
+    """
+    A bounded queue carrying the items of an iterable from a producer thread
+    to a consumer, which iterates over the channel. The producer blocks whilst
+    the queue is full, so no more than ``maxsize`` items are held in memory.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = Queue(maxsize=maxsize)
+        self.cancelled = threading.Event()
+        self.finished = False
+        self.thread = None
+
+    def start(self, iterable):
+        """
+        Start a background thread to ``produce`` the items of ``iterable``.
+        """
+        self.thread = threading.Thread(target=self.produce, args=(iterable,))
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def produce(self, iterable):
+        """
+        Put every item of ``iterable`` onto the queue, stopping early if the
+        channel is closed. Nothing more is read from ``iterable`` or put onto
+        the queue once it is, so a channel closed before its producer gets
+        going doesn't fetch anything at all.
+        """
+        try:
+            iterator = iter(iterable)
+            while not self.cancelled.is_set():
+                item = next(iterator, _DONE)
+                if self.cancelled.is_set():
+                    return
+                self.queue.put(item)
+                if item is _DONE:
+                    return
+        except Exception:
+            if not self.cancelled.is_set():
+                self.queue.put(_Failure(sys.exc_info()))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """
+        Return the next item put onto the queue by ``produce``, re-raising
+        any exception which occurred in the producer.
+        """
+        if self.finished:
+            raise StopIteration
+
+        item = self.queue.get()
+        if item is _DONE:
+            self.finished = True
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self.finished = True
+            exc_type, exc_value, exc_traceback = item.exc_info
+            raise exc_type, exc_value, exc_traceback
+        return item
+
+    def close(self):
+        """
+        Tell the producer to stop, waiting for it to do so if it has a thread
+        of its own. The producer may be part way through producing an item,
+        such as a page being read, which it finishes first.
+        """
+        self.finished = True
+        self.cancelled.set()
+        while True:
+            # Unblock the producer if it is waiting on a full queue, and
+            # keep it unblocked for as long as it may put anything.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if self.thread is None or not self.thread.is_alive():
+                return
+            self.thread.join(0.1)
+
+
+def pipelined(iterable, maxsize=PIPELINE_DEPTH):
+    """
+    Iterate over ``iterable`` in a background thread, so that producing the
+    next items overlaps with the consumer's work on the current one. The
+    returned ``Channel`` should be closed if it isn't read to the end.
+    """
+    return Channel(maxsize).start(iterable)
+
+
+def close_iterable(iterable):
+    """
+    Close ``iterable`` if it is a generator or ``Channel``, so that it stops
+    fetching rows nobody is going to read.
+    """
+    if hasattr(iterable, 'close'):
+        iterable.close()
 
 
 @contextmanager
@@ -346,53 +754,379 @@ def generate_for_box(box_url):
         grids = get_dataset_grids(box_url)
 
         if tables or grids:
-            paged_rows = list(paged_rows_generator(box_url, tables))
-            dump_tables(excel_output, tables, paged_rows)
+            excel_output.reserve_sheet_names(
+                [table['name'] for table in tables] +
+                [grid['name'] for grid in grids])
+
+            fingerprints = get_fingerprints(box_url, tables, grids)
+            if outputs_are_current(excel_output.path, grids, fingerprints):
+                log("Dataset unchanged since the last run, keeping outputs")
+                excel_output.discarded = True
+                for grid in grids:
+                    save_state(grid_filename(grid), 'grid', grid['name'],
+                               'generated')
+                return
+
+            plan_appends(box_url, tables, fingerprints)
+
+            # There's no point fetching more rows than fit in a sheet.
+            paged_rows = paged_rows_generator(box_url, tables,
+                                              limit=excel_output.row_limit)
+            dump_tables(excel_output, tables, paged_rows, fingerprints)
             dump_grids(excel_output, grids)
         else:
             raise DatasetIsEmptyError('Your dataset contains no data')
             pass # This is shown in stack trace
 
+    if not excel_output.encountered_error:
+        save_fingerprints(fingerprints)
+
 
-def make_table(columns, row_dicts):
+def get_fingerprints(box_url, tables, grids):
     """
-    Build a rectangular list-of-lists out of the table described by ``columns``
-    and ``row_dicts``
+    Return a dictionary mapping ``(source_type, source_id)`` to a
+    fingerprint of the content of each table and grid, which changes when the
+    content does. A fingerprint of None means that it couldn't be taken.
     """
+    fingerprints = {}
+    for table in tables:
+        fingerprint = get_table_fingerprint(box_url, table)
+        fingerprints['table', table['name']] = fingerprint
+    for grid in grids:
+        # Grids are identified by the checksum of their content.
+        fingerprints['grid', grid['name']] = json.dumps([grid['id'],
+                                                         grid['url']])
+    return fingerprints
+
+
+def get_table_fingerprint(box_url, table, upto=None):
+    """
+    Return the row count and highest rowid of ``table``, its columns in
+    order and the SQL defining it if it's a view, together with a checksum
+    of its values if ``FINGERPRINT_CHECKSUM`` is set, as a string. With
+    ``upto``, only the rows up to that rowid are fingerprinted.
+    """
+    fields = ['count(*)', 'max(rowid)']
+    where = '' if upto is None else ' WHERE rowid <= %d' % upto
+    query = 'SELECT %s FROM "%s"%s' % (', '.join(fields), table['name'], where)
+    view_query = ("SELECT sql FROM sqlite_master WHERE type = 'view' "
+                  "AND name = '%s'" % table['name'].replace("'", "''"))
+    try:
+        fingerprint = list(query_sql_rows(box_url, query, fields))[0]
+        view_sql = [sql for sql, in query_sql_rows(box_url, view_query,
+                                                   ['sql'])]
+        fingerprint += (list(table['columns']),
+                        view_sql[0] if view_sql else None)
+        if FINGERPRINT_CHECKSUM and table['columns']:
+            fingerprint += (get_table_checksum(box_url, table, where),)
+    except (requests.HTTPError, ValueError) as e:
+        log("{0}: can't fingerprint ({1})".format(table['name'], e))
+        return None
+
+    return json.dumps(fingerprint)
 
-    yield columns
 
-    for row in row_dicts:
-        yield [row.get(column) for column in columns]
+# checksums are sums of row hashes modulo this
+CHECKSUM_MODULUS = 2 ** 64
 
 
-def write_excel_csv(excel_output, sheet_name, filename, rows):
+def get_table_checksum(box_url, table, where=''):
+    """
+    Return the sum of a hash of each row of ``table`` matching the ``where``
+    clause, rowid included, which changes if any value does. SQLite has no
+    hash function of its own, so the rows are read and hashed here. Their
+    order doesn't matter, so views, which have no rowid, are fine too.
+    """
+    keys = [ROWID_COLUMN] + list(table['columns'])
+    query = 'SELECT rowid AS "%s", * FROM "%s"%s' % (
+        ROWID_COLUMN, table['name'], where)
+
+    checksum = 0
+    for row in query_sql_rows(box_url, query, keys):
+        digest = hashlib.sha1(json.dumps(row)).hexdigest()
+        checksum = (checksum + int(digest[:16], 16)) % CHECKSUM_MODULUS
+    return checksum
+
+
+def outputs_are_current(excel_path, grids, fingerprints):
+    """
+    Return True if the outputs for ``grids`` and the workbook at
+    ``excel_path`` exist and were generated from content with the same
+    ``fingerprints``.
+    """
+    if None in fingerprints.values():
+        return False
+
+    paths = [excel_path] + [join(DESTINATION, grid_filename(grid))
+                            for grid in grids]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+
+    return load_fingerprints() == fingerprints
+
+
+def load_fingerprints():
+    """
+    Return the fingerprints saved by the last successful run.
+    """
+    try:
+        rows = scraperwiki.sql.select('* FROM _fingerprints')
+    except Exception:
+        # The table doesn't exist until the first successful run.
+        return {}
+
+    return {(row['source_type'], row['source_id']): row['fingerprint']
+            for row in rows}
+
+
+def save_fingerprints(fingerprints):
+    scraperwiki.sql.execute('DROP TABLE IF EXISTS _fingerprints')
+    scraperwiki.sql.save(['source_type', 'source_id'], [
+        {'source_type': source_type,
+         'source_id': source_id,
+         'fingerprint': fingerprint}
+        for (source_type, source_id), fingerprint in fingerprints.items()
+    ], '_fingerprints')
+    scraperwiki.sql.commit()
+
+
+def make_table(columns, rows):
+    """
+    Build a rectangular table out of the header ``columns`` followed by
+    ``rows``, which are sequences of values in the order of ``columns``.
+    """
+
+    yield tuple(columns)
+
+    for row in rows:
+        yield row
+
+
+def write_excel_csv(excel_output, sheet_name, filename, rows,
+                    pipeline=False):
+    """
+    Write ``rows`` to a new sheet of ``excel_output`` and to the CSV file
+    ``filename``.
+
+    With ``pipeline``, the rows are read and detached from their source in
+    a separate thread, at most ``PIPELINE_DEPTH`` rows ahead of the writers.
+    """
     write_excel_row = excel_output.add_sheet(sheet_name)
 
+    if pipeline:
+        rows = pipelined(imap(detach_row, rows))
+
     with CsvOutput(filename) as csv_output:
-        write_csv_row = csv_output.write_row
+        # Span-free rows for the CSV are gathered up to be written together.
+        batch = []
+
+        try:
+            for row in rows:
+                # Loop structure is intentionally this way because `grid_rows``
+                # is a generator, and this is desirable for low memory usage.
+                if isinstance(row, tuple):
+                    batch.append(row)
+                    if len(batch) >= CSV_BATCH_ROWS:
+                        csv_output.write_rows(batch)
+                        batch = []
+                else:
+                    # Cells which span may be destroyed along with their
+                    # document once the next row is read, so go now.
+                    if batch:
+                        csv_output.write_rows(batch)
+                        batch = []
+                    csv_output.write_row(row)
+
+                if write_excel_row and not write_excel_row(row):
+                    # The sheet is full, but the CSV still wants every row.
+                    write_excel_row = None
+
+            if batch:
+                csv_output.write_rows(batch)
+        finally:
+            close_iterable(rows)
+
 
+def write_excel(excel_output, sheet_name, rows, pipeline=False):
+    """
+    Write ``rows`` to a new sheet of ``excel_output``, optionally pipelined
+    as in ``write_excel_csv``.
+    """
+    write_excel_row = excel_output.add_sheet(sheet_name)
+
+    if pipeline:
+        rows = pipelined(imap(detach_row, rows))
+
+    try:
         for row in rows:
             # Loop structure is intentionally this way because `grid_rows``
             # is a generator, and this is desirable for low memory usage.
-            write_csv_row(row)
-            write_excel_row(row)
+            if not write_excel_row(row):
+                # The sheet is full, so stop reading rows from the source.
+                break
+    finally:
+        close_iterable(rows)
 
 
-def write_excel(excel_output, sheet_name, rows):
-    write_excel_row = excel_output.add_sheet(sheet_name)
+def dump_tables(excel_output, tables, paged_rows, fingerprints=None):
+    """
+    Write each of ``tables`` to a sheet of ``excel_output``. If the tables'
+    ``fingerprints`` are given and ``FINGERPRINT_CHECKSUM`` is set, their
+    rows are also kept in a ``RowCache``, and the cached rows are reused for
+    tables marked by ``plan_appends``.
+    """
 
-    for row in rows:
-        # Loop structure is intentionally this way because `grid_rows``
-        # is a generator, and this is desirable for low memory usage.
-        write_excel_row(row)
+    for table, paged_rows in izip(tables, paged_rows):
+        rows = chain.from_iterable(paged_rows)
+
+        if fingerprints is None or not FINGERPRINT_CHECKSUM:
+            write_excel(excel_output, table['name'],
+                        make_table(table['columns'], rows), pipeline=PIPELINE)
+        else:
+            cache = RowCache(table['name'])
+            fingerprint = fingerprints['table', table['name']]
+            cached_rows, _ = table.get('cached', (0, None))
 
+            with cache.recording(fingerprint, cached_rows) as record:
+                rows = record(rows)
+                if cached_rows:
+                    rows = chain(cache.read(), rows)
+                write_excel(excel_output, table['name'],
+                            make_table(table['columns'], rows),
+                            pipeline=PIPELINE)
 
-def dump_tables(excel_output, tables, paged_rows):
+        # Stop fetching any pages which weren't needed.
+        close_iterable(paged_rows)
 
-    for table, paged_rows in izip(tables, paged_rows):
-        rows = make_table(table['columns'], chain.from_iterable(paged_rows))
-        write_excel(excel_output, table['name'], rows)
+
+def plan_appends(box_url, tables, fingerprints):
+    """
+    Find the tables whose rows are cached and which have only been appended
+    to since, setting their ``cached`` to the number of cached rows and the
+    rowid of the last one. Only the rows after those need fetching.
+
+    Unless ``FINGERPRINT_CHECKSUM`` is set, rows rewritten in place would go
+    unnoticed, so no table is appended to.
+    """
+    for table in tables:
+        table.pop('cached', None)
+        if not FINGERPRINT_CHECKSUM:
+            continue
+        if fingerprints['table', table['name']] is None:
+            continue
+
+        cached = RowCache(table['name']).load_fingerprint()
+        if cached is None:
+            continue
+
+        cached_rows, last_rowid = json.loads(cached)[:2]
+        if not cached_rows or last_rowid is None:
+            # Without a rowid there's no telling which rows come after.
+            continue
+
+        # If the rows up to the last cached one are as they were, any changes
+        # must have been appended after it.
+        if get_table_fingerprint(box_url, table, last_rowid) == cached:
+            log("{0}: appending to {1} cached rows"
+                .format(table['name'], cached_rows))
+            table['cached'] = (cached_rows, last_rowid)
+
+
+class RowCache(object):
+
+    """
+    The rows of a table as exported by a previous run, kept in ``ROW_CACHE``
+    as gzipped JSON lines along with the fingerprint of the table they were
+    taken from.
+    """
+
+    def __init__(self, table_name):
+        key = hashlib.sha1(table_name.encode('utf-8')).hexdigest()
+        self.rows_path = join(ROW_CACHE, key + '.json.gz')
+        self.fingerprint_path = join(ROW_CACHE, key + '.fingerprint')
+
+    def load_fingerprint(self):
+        """
+        Return the fingerprint of the cached rows, or None if there are none.
+        """
+        try:
+            with open(self.fingerprint_path) as fd:
+                return fd.read().decode('utf-8')
+        except IOError:
+            return None
+
+    def read(self):
+        with gzip.open(self.rows_path, 'rb') as fd:
+            for line in fd:
+                yield tuple(json.loads(line))
+
+    def invalidate(self):
+        for path in (self.fingerprint_path, self.rows_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    @contextmanager
+    def recording(self, fingerprint, cached_rows):
+        """
+        Provide a function which wraps an iterable of rows, recording them as
+        they go past. On success, the recorded rows replace the cache, or
+        are appended to it if there are ``cached_rows``, and ``fingerprint``
+        becomes the cache's fingerprint.
+
+        The cache is only kept if it ends up holding every row counted by
+        ``fingerprint``, so tables which were cut short are not cached. Nor
+        are views and other sources with no rowid, which can't be appended
+        to.
+        """
+        if not os.path.isdir(ROW_CACHE):
+            os.makedirs(ROW_CACHE)
+
+        tempfile = NamedTemporaryFile(dir=ROW_CACHE, delete=False)
+        writer = gzip.GzipFile(fileobj=tempfile, mode='wb')
+
+        class State:
+            recorded = 0
+
+        def record(rows):
+            for row in rows:
+                writer.write(json.dumps(row))
+                writer.write(b"\n")
+                State.recorded += 1
+                yield row
+
+        try:
+            yield record
+            writer.close()
+            tempfile.close()
+        except:
+            tempfile.close()
+            os.unlink(tempfile.name)
+            raise
+
+        # Whilst the cache is being changed it has no valid fingerprint.
+        if os.path.exists(self.fingerprint_path):
+            os.unlink(self.fingerprint_path)
+
+        if fingerprint is None:
+            count = last_rowid = None
+        else:
+            count, last_rowid = json.loads(fingerprint)[:2]
+        if count != cached_rows + State.recorded or last_rowid is None:
+            os.unlink(tempfile.name)
+            self.invalidate()
+            return
+
+        if cached_rows:
+            # A file of concatenated gzip streams is itself a gzip file.
+            with open(tempfile.name, 'rb') as new_rows, \
+                    open(self.rows_path, 'ab') as rows:
+                shutil.copyfileobj(new_rows, rows)
+            os.unlink(tempfile.name)
+        else:
+            os.rename(tempfile.name, self.rows_path)
+
+        with open(self.fingerprint_path, 'w') as fd:
+            fd.write(fingerprint.encode('utf-8'))
 
 
 def dump_grids(excel_output, grids):
@@ -400,11 +1134,11 @@ def dump_grids(excel_output, grids):
     for grid in grids:
         grid_rows = get_grid_rows(grid['url'])
 
-        filename = '{}.csv'.format(make_filename(grid['name']))
-        filename = join(DESTINATION, filename)
+        filename = join(DESTINATION, grid_filename(grid))
 
         with update_state(filename, 'grid', grid['name']):
-            write_excel_csv(excel_output, grid['name'], filename, grid_rows)
+            write_excel_csv(excel_output, grid['name'], filename, grid_rows,
+                            pipeline=PIPELINE)
 
 
 def get_dataset_tables(box_url):
@@ -452,15 +1186,45 @@ def get_box_url():
         raise RuntimeError("ERROR: No dataset URL in {}".format(filename))
 
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the ``requests.Session`` shared by all requests to the box, so that
+    connections are kept alive between pages (including across the fetch
+    workers) and responses are gzipped.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=max(FETCH_WORKERS, 1))
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session.headers['Accept-Encoding'] = 'gzip'
+        return _session
+
+
 def call_api(box_url, params=None):
     # returns sql api output as a Python dict/list
-    response = requests.get(box_url, params=params)
+    response = get_session().get(box_url, params=params, stream=True,
+                                 timeout=HTTP_TIMEOUT)
     log("GET %s" % response.url)
-    if response.status_code == requests.codes.ok:
-        return json.loads(response.content,
-                          object_pairs_hook=collections.OrderedDict)
-    else:
-        response.raise_for_status()
+    try:
+        if response.status_code == requests.codes.ok:
+            # json.load reads the whole body before parsing it, but it is
+            # decompressed chunkwise on the way, so the compressed body is
+            # never held as well. Table pages, which can be large, are
+            # decoded row by row by query_sql_rows instead.
+            body = GeneratorReader(response.iter_content(CHUNK_SIZE))
+            return json.load(body, object_pairs_hook=collections.OrderedDict)
+        else:
+            response.raise_for_status()
+    finally:
+        response.close()
 
 
 def query_sql_database(box_url, query):
@@ -471,15 +1235,261 @@ def get_database_meta(box_url):
     return call_api("%s/sql/meta" % box_url)
 
 
-def get_paged_rows(box_url, table_name):
-    start = 0
+def query_sql_rows(box_url, query, keys):
+    """
+    Lazily yield the rows returned by ``query`` as tuples of the values of
+    ``keys``, decoding the response one row at a time.
+    """
+    response = get_session().get("%s/sql" % box_url, params={"q": query},
+                                 stream=True, timeout=HTTP_TIMEOUT)
+    log("GET %s" % response.url)
+    try:
+        response.raise_for_status()
+        for row in iter_json_rows(response.iter_content(CHUNK_SIZE), keys):
+            yield row
+    finally:
+        response.close()
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# what the end of a JSON object is looked for at, outside strings and in them
+_JSON_STRUCTURE = re.compile(r'[{}\[\]"]')
+_JSON_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class JsonObjectScanner(object):
+
+    """
+    Finds the end of a JSON object whose text arrives a piece at a time,
+    carrying its place from one piece to the next, so that each character
+    is only looked at once however many pieces the object spans.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def scan(self, text, pos=0):
+        """
+        Return the index in ``text`` just past the end of the object, or None
+        if it doesn't end in ``text``.
+        """
+        while True:
+            if self.escaped:
+                if pos >= len(text):
+                    return None
+                pos += 1
+                self.escaped = False
+
+            if self.in_string:
+                match = _JSON_STRING_SPECIAL.search(text, pos)
+                if match is None:
+                    return None
+                pos = match.end()
+                if match.group() == "\\":
+                    self.escaped = True
+                else:
+                    self.in_string = False
+                continue
+
+            match = _JSON_STRUCTURE.search(text, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+
+
+def iter_json_rows(chunks, keys):
+    """
+    Incrementally decode the JSON list of objects arriving as ``chunks`` of
+    UTF-8 bytes, yielding a tuple of the values of ``keys`` for each object.
+
+    Only one object is held in memory at a time, however long the list is.
+    An object which spans chunks is gathered up until a ``JsonObjectScanner``
+    finds its end, and only then decoded, so long values cost linear time.
+    """
+    def row_hook(pairs):
+        values = dict(pairs)
+        return tuple([values.get(key) for key in keys])
+
+    raw_decode = json.JSONDecoder(object_pairs_hook=row_hook).raw_decode
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+
+    buf, pos, eof = u"", 0, False
+    expecting = "["
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Truncated JSON list of rows")
+            chunk = next(chunks, None)
+            eof = chunk is None
+            buf, pos = decoder.decode(chunk or b"", final=eof), 0
+            continue
+
+        char = buf[pos]
+
+        if expecting == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON list of rows")
+            expecting = "row"
+            pos += 1
+
+        elif char == "]" and expecting in ("row", ","):
+            return
+
+        elif expecting == ",":
+            if char != ",":
+                raise ValueError("Expected ',' at {0!r}".format(buf[pos:]))
+            expecting = "row"
+            pos += 1
+
+        else:
+            if char != "{":
+                raise ValueError("Expected a JSON object at {0!r}"
+                                 .format(buf[pos:]))
+            try:
+                row, pos = raw_decode(buf, pos)
+            except ValueError:
+                # The row may just be incomplete, so read on to its end.
+                if eof:
+                    raise
+                scanner = JsonObjectScanner()
+                end = scanner.scan(buf, pos)
+                if end is not None:
+                    # It was complete, and is malformed.
+                    raise
+                pieces = [buf[pos:]]
+                while end is None:
+                    if eof:
+                        raise ValueError("Truncated JSON list of rows")
+                    chunk = next(chunks, None)
+                    eof = chunk is None
+                    buf = decoder.decode(chunk or b"", final=eof)
+                    pieces.append(buf)
+                    end = scanner.scan(buf)
+                buf = u"".join(pieces)
+                row, pos = raw_decode(buf)
+            yield row
+            expecting = ","
+
+
+class KeysetPage(object):
+
+    """
+    One page of rows from ``get_paged_rows``, which notes the rowid of each
+    row as it goes past so that the next page can follow on from it.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.last_rowid = None
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.last_rowid = row[0]
+            self.count += 1
+            yield row[1:]
+
+
+def get_paged_rows(box_url, table_name, columns, limit=None, after=None):
+    """
+    Yield the rows of ``table_name`` a page at a time, each row being a tuple
+    of the values of ``columns``. No more than ``limit`` rows are fetched,
+    and if ``after`` is given only those rows with a greater rowid, which
+    ValueError is raised for if the table turns out to have no rowid.
+
+    Pages are fetched by rowid watermark, so that SQLite can seek straight to
+    each page instead of re-scanning every row skipped by an OFFSET. Views and
+    WITHOUT ROWID tables have no usable rowid, and are paged by offset.
+
+    Pages are decoded lazily as they are iterated over, and each must be
+    consumed before the next is requested.
+    """
+    keys = [ROWID_COLUMN] + list(columns)
+    remaining = limit
+
+    query = keyset_query(table_name, after, page_size(remaining))
+    rows = query_sql_rows(box_url, query, keys)
+    try:
+        first = next(rows, None)
+    except (requests.HTTPError, ValueError) as e:
+        log("{0}: no rowid, paging by offset ({1})".format(table_name, e))
+        first = (None,)
+
+    if first is not None and first[0] is None:
+        rows.close()
+        if after is not None:
+            # Paging by offset would start over from the first row.
+            raise ValueError("{0}: no rowid to fetch rows after {1} by"
+                             .format(table_name, after))
+        for rows in get_offset_paged_rows(box_url, table_name, columns,
+                                          limit):
+            yield rows
+        return
+
+    page = KeysetPage(chain([first], rows) if first is not None else rows)
     while True:
-        q = 'SELECT * FROM "%s" LIMIT %d, %d' % (table_name, start, PAGE_SIZE)
-        rows = query_sql_database(box_url, q)
+        yield page
+        # Make sure that the page has been read to the end, to find the rowid
+        # the next page starts from.
+        for _ in page:
+            pass
+        if not page.count:
+            return
+        if remaining is not None:
+            remaining -= page.count
+            if remaining <= 0:
+                return
+        query = keyset_query(table_name, page.last_rowid, page_size(remaining))
+        page = KeysetPage(query_sql_rows(box_url, query, keys))
+
+
+def page_size(remaining):
+    """
+    Return how many rows to ask for in the next page, given that at most
+    ``remaining`` more rows are wanted (None meaning no limit).
+    """
+    if remaining is None:
+        return PAGE_SIZE
+    return min(PAGE_SIZE, remaining)
+
+
+def keyset_query(table_name, after, size):
+    """
+    Return the query for the ``size`` rows of ``table_name`` following rowid
+    ``after``, or the first page if ``after`` is None. The rowid of each row
+    is returned in ``ROWID_COLUMN``.
+    """
+    where = '' if after is None else 'WHERE rowid > %d ' % after
+    return 'SELECT rowid AS "%s", * FROM "%s" %sORDER BY rowid LIMIT %d' % (
+        ROWID_COLUMN, table_name, where, size)
+
+
+def get_offset_paged_rows(box_url, table_name, columns, limit=None):
+    start = 0
+    while limit is None or start < limit:
+        size = page_size(None if limit is None else limit - start)
+        q = 'SELECT * FROM "%s" LIMIT %d, %d' % (table_name, start, size)
+        rows = list(query_sql_rows(box_url, q, columns))
         if not rows:
             break
         yield rows
-        start += PAGE_SIZE
+        start += size
 
 
 def grid_rows_from_string(text):
@@ -526,34 +1536,190 @@ def grid_rows_from_string_old(text):
     return data
 
 
-def get_grid_rows(grid_url):
-    response = requests.get(grid_url)
+def get_grid_rows(grid_url, streaming=None):
+    """
+    Return the rows of the grid at ``grid_url``, as read by
+    ``generate_grid_rows`` unless ``streaming`` (by default
+    ``STREAMING_GRIDS``) is false, in which case the whole document is
+    parsed up front by ``grid_rows_from_string``.
+    """
+    if streaming is None:
+        streaming = STREAMING_GRIDS
+
+    if streaming:
+        return generate_grid_rows(grid_url)
+
+    response = get_session().get(grid_url, timeout=HTTP_TIMEOUT)
     log("GET %s" % response.url)
     response.encoding = 'utf-8'
     return grid_rows_from_string(response.text)
 
 
+# named character references which XML doesn't know about
+HTML_ENTITY = re.compile(br"&([A-Za-z][A-Za-z0-9]*);")
+XML_ENTITIES = frozenset(["amp", "lt", "gt", "quot", "apos"])
+
+
+def numeric_entities(chunks):
+    """
+    Rewrite HTML named character references such as ``&nbsp;`` in the byte
+    strings of ``chunks`` as numeric ones, which the XML parser understands.
+    """
+    def replace(match):
+        name = match.group(1)
+        if name in XML_ENTITIES or name not in name2codepoint:
+            return match.group(0)
+        return b"&#%d;" % name2codepoint[name]
+
+    pending = b""
+    for chunk in chunks:
+        chunk = pending + chunk
+        # Hold back a reference which may be split across chunks.
+        cut = chunk.rfind(b"&")
+        if cut != -1 and b";" not in chunk[cut:] and len(chunk) - cut < 32:
+            chunk, pending = chunk[:cut], chunk[cut:]
+        else:
+            pending = b""
+        yield HTML_ENTITY.sub(replace, chunk)
+
+    if pending:
+        yield HTML_ENTITY.sub(replace, pending)
+
+
+# what may come ahead of a document's first element
+PROLOG = re.compile(br"(\xef\xbb\xbf)?\s*(<\?xml[^>]*\?>\s*)?(<!DOCTYPE[^>\[]*>)?")
+
+
+def wrap_fragment(chunks):
+    """
+    Yield the byte strings of ``chunks`` inside a root element of their own,
+    so that a document of several elements, such as a grid's <meta> and
+    <table>, is well-formed. A byte order mark, XML declaration or doctype
+    is kept ahead of the root.
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 1024:
+            break
+
+    prolog = PROLOG.match(head).end()
+    yield head[:prolog] + b"<fragment>" + head[prolog:]
+    for chunk in chunks:
+        yield chunk
+    yield b"</fragment>"
+
+
+def read_fragment(input_html):
+    """
+    Return a file-like object reading ``input_html`` as ``wrap_fragment``
+    wraps it, with its named character references made numeric.
+    """
+    chunks = iter(lambda: input_html.read(CHUNK_SIZE), b"")
+    return GeneratorReader(wrap_fragment(numeric_entities(chunks)))
+
+
+class NoTree(object):
+
+    """
+    Parser target which builds nothing, for when all that matters is whether
+    a document parses.
+    """
+
+    def close(self):
+        return True
+
+
+def is_well_formed(input_html):
+    """
+    Return True if ``input_html`` is a well-formed XML fragment, HTML's
+    named character references aside. ``find_trs`` reads such documents
+    just as an HTML parser would.
+    """
+    parser = lxml.etree.XMLParser(target=NoTree(), huge_tree=True)
+    try:
+        return lxml.etree.parse(read_fragment(input_html), parser)
+    except lxml.etree.XMLSyntaxError:
+        return False
+
+
+# the elements find_trs looks for, as named in HTML
+TABLE_TAGS = frozenset(["table", "tr", "td", "th"])
+
+
+def html_name(name):
+    """
+    Return the name an HTML parser gives the element or attribute the XML
+    parser calls ``name``, which may be in upper case or in a namespace.
+    """
+    return name.rpartition("}")[2].lower()
+
+
+def html_attributes(element):
+    """
+    Rename the attributes of ``element`` as an HTML parser would name them.
+    """
+    for name, value in element.attrib.items():
+        if html_name(name) != name:
+            del element.attrib[name]
+            element.attrib[html_name(name)] = value
+
+
 def find_trs(input_html):
     """
-    Parse ``input_html`` streamwise, yielding one list per <tr> containing
-    ``lxml.html.HtmlElement``.
+    Parse ``input_html`` streamwise, yielding one row per <tr>: a tuple of
+    the text of its <td> and <th> elements if none of them span, otherwise
+    a list of the elements themselves.
 
-    The row *must* be consumed immediately since the lxml.HtmlElement are
-    destroyed to conserve memory.
+    Tables nested inside cells are left as part of their cell's content,
+    rather than producing rows of their own.
+
+    ``input_html`` must be ``is_well_formed``; markup which only an HTML
+    parser can read is for ``grid_rows_from_html``. Names are taken
+    regardless of case and namespace, as they are in HTML.
+
+    A list *must* be consumed immediately since the elements are destroyed
+    to conserve memory.
     """
-    parser = lxml.etree.iterparse(input_html, events=("end",))
-    row = []
+    parser = lxml.etree.iterparse(read_fragment(input_html),
+                                  events=("start", "end"), huge_tree=True)
+    # How many <table>s the parser is inside.
+    depth = 0
+    row = None
+
+    for event, element in parser:
+        tag = element.tag
+        if tag not in TABLE_TAGS:
+            tag = html_name(tag)
+
+        if event == "start":
+            if tag == "table":
+                depth += 1
+            elif depth == 1 and tag == "tr":
+                row = []
+            elif depth == 1 and tag in ("td", "th") and row is not None:
+                if element.attrib:
+                    html_attributes(element)
+                row.append(element)
+            continue
 
-    for _, element in parser:
+        if tag == "table":
+            depth -= 1
 
-        if element.tag == "td":
-            row.append(element)
+        if depth > 1:
+            # Inside a nested table, which is part of the content of one of
+            # the cells of the outer table.
             continue
 
-        if element.tag == "tr":
-            yield row
+        if depth == 1:
+            if tag != "tr":
+                # Content of a cell of the current row, which mustn't be
+                # cleared until the row has been consumed.
+                continue
 
-            row[:] = []
+            yield simplify_row(row)
+            row = None
 
         # These few lines make the memory requirements go from as high as
         # 8 GB to ~1MB when parsing large files.
@@ -562,21 +1728,54 @@ def find_trs(input_html):
             del element.getparent()[0]
 
 
+def grid_rows_from_html(text):
+    """
+    Parse the whole of the HTML document ``text``, yielding its rows as
+    ``find_trs`` would: those of tables which aren't inside another, with
+    their <td> and <th> cells.
+    """
+    dom = lxml.html.fromstring(text)
+
+    for tr in dom.iter("tr"):
+        if len(list(tr.iterancestors("table"))) == 1:
+            yield simplify_row([cell for cell in tr
+                                if cell.tag in ("td", "th")])
+
+
 def generate_grid_rows(grid_url):
     """
     Lazy generator of rows for the grid at ``grid_url``.
 
-    Doesn't cause the whole grid to be loaded into memory at any one time, so
-    has very low memory requirements.
+    The grid is downloaded to a temporary file first. If it is well-formed,
+    as grids generally are, it is parsed streamwise by ``find_trs``, so the
+    whole grid isn't loaded into memory at any one time. Otherwise only the
+    HTML parser can be relied on to read it, and it is parsed whole.
 
     Rows *must* be consumed immediately.
     """
-    response = requests.get(url, stream=True)
-    # Note: this happens to be the size that lxml.etree.iterparse uses when
-    #       parsing file-like objects. It doesn't have a very big impact on
-    #       performance.
-    CHUNK_SIZE = 32 * 1024
-    return find_trs(GeneratorReader(response.iter_content(CHUNK_SIZE)))
+    with TemporaryFile() as body:
+        response = get_session().get(grid_url, stream=True,
+                                     timeout=HTTP_TIMEOUT)
+        log("GET %s" % response.url)
+        try:
+            response.raise_for_status()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                body.write(chunk)
+        finally:
+            response.close()
+
+        body.seek(0)
+        well_formed = is_well_formed(body)
+        body.seek(0)
+
+        if well_formed:
+            for row in find_trs(body):
+                yield row
+            return
+
+        log("{0}: not well-formed, parsing it whole".format(grid_url))
+        for row in grid_rows_from_html(body.read().decode("utf-8", "replace")):
+            yield row
 
 
 def save_state(filename, source_type, source_id, state):
@@ -598,6 +1797,10 @@ def save_state(filename, source_type, source_id, state):
     }, '_state_files')
 
 
+def grid_filename(grid):
+    return '{}.csv'.format(make_filename(grid['name']))
+
+
 def make_filename(naughty_string):
     # if you change this function, make sure to
     # also change the one in code.js
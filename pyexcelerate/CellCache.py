@@ -0,0 +1,53 @@
+class CellCache(object):
+	"""
+	Remembers the XML of up to ``size`` recently used cell values. Rather
+	than keep an exact order of use, which costs more than rendering most
+	cells, values are kept in two generations of half that size: once the
+	recent one is full it becomes the older one, and what is still used from
+	the older one is moved back into the recent one. Whatever goes unused
+	for a generation is forgotten.
+
+	Keys should include the class of the value, as 1, 1.0 and True are
+	equal as keys but needn't be written the same way.
+	"""
+	SIZE = 10000
+
+	def __init__(self, size=None):
+		self._generation_size = max(1, (size or CellCache.SIZE) // 2)
+		self._recent = {}
+		self._older = {}
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self._recent) + len(self._older)
+
+	def get(self, key):
+		value = self._recent.get(key)
+		if value is not None:
+			self.hits += 1
+			return value
+		value = self._older.pop(key, None)
+		if value is not None:
+			self.hits += 1
+			self.set(key, value)
+			return value
+		self.misses += 1
+		return None
+
+	def set(self, key, value):
+		if len(self._recent) >= self._generation_size:
+			self._older = self._recent
+			self._recent = {}
+		self._recent[key] = value
+
+	def clear(self):
+		self._recent = {}
+		self._older = {}
+
+	@property
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		if lookups == 0:
+			return 0.0
+		return float(self.hits) / lookups
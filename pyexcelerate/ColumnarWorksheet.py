@@ -0,0 +1,209 @@
+from array import array
+from .Worksheet import Worksheet
+from .Range import Range
+from .DataTypes import DataTypes
+from . import six
+from .safe_xml import replace_invalid_xml_chars_all
+try:
+	import numpy as np
+	HAS_NUMPY = True
+except:
+	HAS_NUMPY = False
+
+class ColumnarWorksheet(Worksheet):
+	"""
+	A worksheet keeping each column as arrays rather than a dict of boxed
+	values per row: a byte per cell saying what kind of value it holds, and
+	a double per cell holding the value, or the index of a string in the
+	sheet's table of distinct strings. Anything else, such as dates, longs
+	and formulas, is kept as it is. A numeric cell costs 9 bytes.
+
+	The numeric columns of NumPy arrays are copied in whole by set_array.
+	"""
+	# what the kind of a cell says
+	EMPTY = 0
+	FLOAT = 1
+	INT = 2 # ints that a double holds exactly
+	STRING = 3
+	OBJECT = 4
+	MAX_EXACT_INT = 2 ** 53
+	# how many rows are serialized a column at a time
+	BLOCK_ROWS = 1024
+	# how many distinct strings are escaped at a time
+	STRING_BATCH = 64
+
+	def __init__(self, name, workbook, data=None):
+		super(ColumnarWorksheet, self).__init__(name, workbook)
+		self._num_rows = 0
+		self._kinds = {} # column => bytearray of the kind of each row's cell
+		self._values = {} # column => array('d') of each row's value
+		self._objects = {} # (row, column) => value, for OBJECT cells
+		self._strings = []
+		self._string_keys = {}
+		if ColumnarWorksheet.is_array(data):
+			self.set_array(data)
+		elif data is not None:
+			for x, row in enumerate(data, 1):
+				for y, cell in enumerate(row, 1):
+					self.set_cell_value(x, y, cell)
+					self._columns = max(self._columns, y)
+
+	def __getitem__(self, key):
+		self._num_rows = max(self._num_rows, key)
+		return Range((key, 1), (key, float('inf')), self) # return a row range
+
+	@property
+	def num_rows(self):
+		return max(self._num_rows, 1)
+
+	def _get_column(self, y, rows):
+		# the arrays of column y, long enough for the first rows
+		if y not in self._kinds:
+			self._kinds[y] = bytearray()
+			self._values[y] = array('d')
+		kinds = self._kinds[y]
+		values = self._values[y]
+		if len(kinds) < rows:
+			values.extend(array('d', [0.0]) * (rows - len(kinds)))
+			kinds.extend(bytearray(rows - len(kinds)))
+		return kinds, values
+
+	def get_cell_value(self, x, y):
+		kinds = self._kinds.get(y)
+		if kinds is None or x > len(kinds):
+			return None
+		kind = kinds[x - 1]
+		if kind == ColumnarWorksheet.EMPTY:
+			return None
+		elif kind == ColumnarWorksheet.FLOAT:
+			return self._values[y][x - 1]
+		elif kind == ColumnarWorksheet.INT:
+			return int(self._values[y][x - 1])
+		elif kind == ColumnarWorksheet.STRING:
+			return Worksheet._get_value(self._strings[int(self._values[y][x - 1])])
+		return Worksheet._get_value(self._objects[(x, y)])
+
+	def set_cell_value(self, x, y, value):
+		kinds = self._kinds.get(y)
+		if kinds is None or len(kinds) < x:
+			kinds, values = self._get_column(y, x)
+		else:
+			values = self._values[y]
+		if kinds[x - 1] == ColumnarWorksheet.OBJECT:
+			del self._objects[(x, y)]
+		cls = value.__class__
+		if value is None:
+			kinds[x - 1] = ColumnarWorksheet.EMPTY
+		elif cls is float:
+			kinds[x - 1] = ColumnarWorksheet.FLOAT
+			values[x - 1] = value
+		elif cls is int and -ColumnarWorksheet.MAX_EXACT_INT <= value <= ColumnarWorksheet.MAX_EXACT_INT:
+			kinds[x - 1] = ColumnarWorksheet.INT
+			values[x - 1] = value
+		elif isinstance(value, six.string_types) and value[:1] != '=':
+			# keyed by class too, as 'a' and u'a' are equal as keys
+			key = self._string_keys.get((cls, value))
+			if key is None:
+				key = self._string_keys[(cls, value)] = len(self._strings)
+				self._strings.append(value)
+			kinds[x - 1] = ColumnarWorksheet.STRING
+			values[x - 1] = key
+		else:
+			if DataTypes.get_type(value) == DataTypes.DATE:
+				self._set_date_style(x, y)
+			kinds[x - 1] = ColumnarWorksheet.OBJECT
+			self._objects[(x, y)] = value
+		if x > self._num_rows and value is not None:
+			self._num_rows = x
+
+	@staticmethod
+	def is_array(data):
+		return HAS_NUMPY and isinstance(data, np.ndarray)
+
+	def set_array(self, data, x=1, y=1):
+		# Sets the cells from a 2-D array, or the fields of a record array,
+		# with the first at row x and column y. NaNs and infinities, which
+		# Excel has no way of writing, leave their cells empty.
+		if data.dtype.names:
+			columns = [data[name] for name in data.dtype.names]
+		elif data.ndim == 2:
+			columns = [data[:, j] for j in six.moves.xrange(data.shape[1])]
+		else:
+			raise Exception("Only 2-D and record arrays can be set")
+		for j, column in enumerate(columns):
+			self._set_column_array(x, y + j, column)
+			self._columns = max(self._columns, y + j)
+
+	def _set_column_array(self, x, y, column):
+		if column.dtype.kind == 'f':
+			kinds = np.where(np.isfinite(column), ColumnarWorksheet.FLOAT, ColumnarWorksheet.EMPTY)
+		elif column.dtype.kind in 'iu' and (len(column) == 0 or
+				(column.min() >= -ColumnarWorksheet.MAX_EXACT_INT and column.max() <= ColumnarWorksheet.MAX_EXACT_INT)):
+			kinds = np.full(len(column), ColumnarWorksheet.INT, dtype=np.uint8)
+		else:
+			# strings, dates, records and the like are set one at a time
+			for i, value in enumerate(column.tolist()):
+				self.set_cell_value(x + i, y, value)
+			return
+		if len(column) == 0:
+			return
+
+		end = x - 1 + len(column)
+		column_kinds, column_values = self._get_column(y, end)
+		if ColumnarWorksheet.OBJECT in column_kinds[x - 1:end]:
+			for i in six.moves.xrange(x, end + 1):
+				self._objects.pop((i, y), None)
+		column_kinds[x - 1:end] = bytearray(kinds.astype(np.uint8).tostring())
+		values = array('d')
+		values.fromstring(np.where(kinds, column, 0).astype(np.float64).tostring())
+		column_values[x - 1:end] = values
+		nonempty = np.flatnonzero(kinds)
+		if len(nonempty):
+			self._num_rows = max(self._num_rows, x + int(nonempty[-1]))
+
+	def _get_string_xml(self):
+		# what follows the reference of a cell for each distinct string
+		if self._parent.shared_strings is not None:
+			return [self._get_cell_xml(string) for string in self._strings]
+		string_xml = []
+		for start in six.moves.xrange(0, len(self._strings), ColumnarWorksheet.STRING_BATCH):
+			strings = self._strings[start:start + ColumnarWorksheet.STRING_BATCH]
+			string_xml.extend(Worksheet._INLINE_STRING_XML % string for string in replace_invalid_xml_chars_all(strings))
+		return string_xml
+
+	def get_xml_data(self):
+		# Precondition: styles are aligned.
+		# The cells are serialized a column at a time, for a block of rows at
+		# a time, going by their kinds rather than typing their values.
+		columns = sorted(self._kinds)
+		styles = self._styles
+		string_xml = self._get_string_xml()
+		for start in six.moves.xrange(1, self._num_rows + 1, ColumnarWorksheet.BLOCK_ROWS):
+			end = min(start + ColumnarWorksheet.BLOCK_ROWS, self._num_rows + 1)
+			block = [[] for x in six.moves.xrange(start, end)]
+			rows = [str(x) for x in six.moves.xrange(start, end)]
+			for y in columns:
+				name = "<c r=\"" + Range.column_to_string(y)
+				column_style = self._column_styles.get(y)
+				kinds = self._kinds[y]
+				values = self._values[y]
+				for x in six.moves.xrange(start, min(end, len(kinds) + 1)):
+					kind = kinds[x - 1]
+					if kind == ColumnarWorksheet.EMPTY:
+						continue
+					elif kind == ColumnarWorksheet.FLOAT or kind == ColumnarWorksheet.INT:
+						cell_data = Worksheet._get_number_xml(values[x - 1])
+					elif kind == ColumnarWorksheet.STRING:
+						cell_data = string_xml[int(values[x - 1])]
+					else:
+						cell_data = self._get_cell_xml(self._objects[(x, y)])
+					style = column_style
+					if x in styles and y in styles[x]:
+						style = styles[x][y]
+					if style is None:
+						block[x - start].append(name + rows[x - start] + cell_data)
+					else:
+						block[x - start].append("%s%s\" s=\"%d%s" % (name, rows[x - start], style.id, cell_data))
+			for index, row_data in enumerate(block):
+				if row_data:
+					yield start + index, row_data
@@ -2,6 +2,7 @@ from .Utility import Utility
 from . import Color
 
 class Fill(object):
+	_DEFAULT_BACKGROUND = Color.Color()
 	def __init__(self, background=None):
 		self._background = background
 
@@ -15,7 +16,7 @@ class Fill(object):
 
 	@property
 	def is_default(self):
-		return self == Fill()
+		return self._background is None or self._background == Fill._DEFAULT_BACKGROUND
 
 	def __eq__(self, other):
 		if other is None:
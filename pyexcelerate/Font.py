@@ -37,7 +37,7 @@ class Font(object):
 		
 	@property
 	def is_default(self):
-		return self == Font()
+		return self._to_tuple() == Font._DEFAULT_TUPLE
 
 	def __or__(self, other):
 		return self._binary_operation(other, Utility.nonboolean_or)
@@ -86,4 +86,6 @@ class Font(object):
 	
 	def __repr__(self):
 		return "<%s>" % self.__str__()
-		
\ No newline at end of file
+
+# what is_default compares with, rather than making a Font() every time
+Font._DEFAULT_TUPLE = Font()._to_tuple()
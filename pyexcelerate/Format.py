@@ -26,7 +26,7 @@ class Format(object):
 	
 	@property
 	def is_default(self):
-		return self == Format()
+		return self.format is None
 
 	@property
 	def id(self):
@@ -11,14 +11,17 @@ from six.moves import reduce
 class Range(object):
 	A = ord('A')
 	Z = ord('Z')
+	# the size of an xlsx sheet
+	MAX_ROWS = 1048576
+	MAX_COLUMNS = 16384
 	def __init__(self, start, end, worksheet, validate=True):
 		self._start = (Range.string_to_coordinate(start) if validate and isinstance(start, six.string_types) else start)
 		self._end = (Range.string_to_coordinate(end) if validate and isinstance(end, six.string_types) else end)
-		if (not (1 <= self._start[0] <= 65536) and self._start[0] != float('inf')) \
-			or (not (1 <= self._end[0] <= 65536) and self._end[0] != float('inf')):
+		if (not (1 <= self._start[0] <= Range.MAX_ROWS) and self._start[0] != float('inf')) \
+			or (not (1 <= self._end[0] <= Range.MAX_ROWS) and self._end[0] != float('inf')):
 			raise Exception("Row index out of bounds")
-		if (not (1 <= self._start[1] <= 256) and self._start[1] != float('inf')) \
-			or (not (1 <= self._end[1] <= 256) and self._end[1] != float('inf')):
+		if (not (1 <= self._start[1] <= Range.MAX_COLUMNS) and self._start[1] != float('inf')) \
+			or (not (1 <= self._end[1] <= Range.MAX_COLUMNS) and self._end[1] != float('inf')):
 			raise Exception("Column index out of bounds")
 		self.worksheet = worksheet
 		self.is_cell = (self._start == self._end)
@@ -42,6 +45,8 @@ class Range(object):
 	def style(self):
 		if self.is_row:
 			return self.__get_attr(self.worksheet.get_cell_style, Range.AttributeInterceptor(self.worksheet.get_row_style(self.x), ''))
+		if self.is_column:
+			return self.__get_attr(self.worksheet.get_cell_style, Range.AttributeInterceptor(self.worksheet.get_column_style(self.y), ''))
 		return self.__get_attr(self.worksheet.get_cell_style, Range.AttributeInterceptor(self, 'style'))
 		
 	@style.setter
@@ -75,9 +80,9 @@ class Range(object):
 	# note that these are not the python __getattr__/__setattr__
 	def __get_attr(self, method, default=None):
 		if self.is_cell:
-			for merge in self.worksheet.merges:
-				if self in merge:
-					return method(merge._start[0], merge._start[1])
+			merge = self.worksheet.get_merge(self.x, self.y)
+			if merge is not None:
+				return method(merge._start[0], merge._start[1])
 			return method(self.x, self.y)
 		elif default:
 			return default
@@ -86,14 +91,17 @@ class Range(object):
 	
 	def __set_attr(self, method, data):
 		if self.is_cell:
-			for merge in self.worksheet.merges:
-				if self in merge:
-					method(merge._start[0], merge._start[1], data)
-					return
+			merge = self.worksheet.get_merge(self.x, self.y)
+			if merge is not None:
+				method(merge._start[0], merge._start[1], data)
+				return
 			method(self.x, self.y, data)
 		elif self.is_row and isinstance(data, Style.Style):
 			# Applying a row style
 			self.worksheet.set_row_style(self.x, data)
+		elif self.is_column and isinstance(data, Style.Style):
+			# Applying a column style
+			self.worksheet.set_column_style(self.y, data)
 		elif DataTypes.DataTypes.get_type(data) != DataTypes.DataTypes.ERROR:
 			# Attempt to apply in batch
 			for cell in self:
@@ -141,9 +149,7 @@ class Range(object):
 		return self.intersection(item) == item
 
 	def __hash__(self):
-		def hash(val):
-			return val[0] << 8 + val[1]
-		return hash(self._start) << 24 + hash(self._end)
+		return hash((self._start, self._end))
 
 	def __str__(self):
 		return Range.coordinate_to_string(self._start) + ":" + Range.coordinate_to_string(self._end)
@@ -192,13 +198,20 @@ class Range(object):
 
 	_cts_cache = {}
 	@staticmethod
-	def coordinate_to_string(coord):
+	def column_to_string(y):
 		# convert an integer to base-26 name
-		y = coord[1] - 1
 		if y not in Range._cts_cache:
-			s = ""	
-			while y >= 0:
-				s = chr((y % 26) + Range.A) + s
-				y = int(y / 26) - 1
+			s = ""
+			column = y - 1
+			while column >= 0:
+				s = chr((column % 26) + Range.A) + s
+				column = int(column / 26) - 1
 			Range._cts_cache[y] = s
+		return Range._cts_cache[y]
+
+	@staticmethod
+	def coordinate_to_string(coord):
+		y = coord[1]
+		if y not in Range._cts_cache:
+			Range.column_to_string(y)
 		return Range._cts_cache[y] + str(coord[0])
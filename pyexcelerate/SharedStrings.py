@@ -1,19 +1,46 @@
-# NB: Not actually used atm
+import threading
+from .safe_xml import replace_invalid_xml_chars
 
 class SharedStrings(object):
-	def __init__(self, workbook):
+	"""
+	The workbook's table of strings, which cells refer to by their index
+	rather than repeating them inline. Once MAX_STRINGS distinct strings are
+	in the table, get_key gives None for new ones, which are then written
+	inline, so a column of unique text can't make the table grow for ever.
+	"""
+	MAX_STRINGS = 100000
+
+	def __init__(self, workbook, max_strings=None):
 		self._parent = workbook
 		self._map = {}
-		self._index = 1
-		
+		self._strings = [] # escaped and utf-8 encoded, by index
+		self._max_strings = SharedStrings.MAX_STRINGS if max_strings is None else max_strings
+		# sheets may be serialized on several threads at once
+		self._lock = threading.Lock()
+
 	@property
 	def workbook(self):
 		return self._parent
-		
+
+	def __len__(self):
+		return len(self._strings)
+
 	def get_key(self, s):
-		# get the key for s
-		if s not in self._map:
-			self._map[s] = self._index
-			self._index += 1
-		return self._map[s]
-		
\ No newline at end of file
+		# get the key for s, or None if the table is full
+		key = self._map.get(s)
+		if key is not None:
+			return key
+		with self._lock:
+			if s in self._map:
+				return self._map[s]
+			if len(self._strings) >= self._max_strings:
+				return None
+			key = len(self._strings) # Excel counts these from 0
+			self._strings.append(replace_invalid_xml_chars(s).encode("utf-8"))
+			self._map[s] = key
+			return key
+
+	def get_xml_data(self):
+		# the contents of <sst>, as utf-8 encoded <si> elements
+		for s in self._strings:
+			yield b"<si><t>" + s + b"</t></si>"
@@ -1,6 +1,7 @@
 from . import six
 from . import Font, Fill, Format
 from .Utility import Utility
+from copy import deepcopy
 
 class Style(object):
 	_DEFAULT_FORMAT = Format.Format()
@@ -10,6 +11,11 @@ class Style(object):
 		self._font = font
 		self._fill = fill
 		self._format = format
+		# shared by many cells, which get a copy of their own to change
+		self._interned = False
+
+	def copy(self):
+		return Style(font=deepcopy(self._font), fill=deepcopy(self._fill), format=deepcopy(self._format))
 
 	@property
 	def is_default(self):
@@ -1,34 +1,90 @@
 from . import Worksheet
+from .WriteOnlyWorksheet import WriteOnlyWorksheet
+from .ColumnarWorksheet import ColumnarWorksheet
 from .Writer import Writer
+from .Style import Style
+from .SharedStrings import SharedStrings
+from .Format import Format
+from itertools import chain
+import threading
 import time
 
 class Workbook(object):
 	# map for attribute sets => style attribute id's
 	STYLE_ATTRIBUTE_MAP = {'fonts':'_font', 'fills':'_fill', 'num_fmts':'_format'}
 	STYLE_ID_ATTRIBUTE = 'id'
-	alignment = None
-	def __init__(self, encoding='utf-8'):
+	def __init__(self, encoding='utf-8', compress_workers=1, shared_strings=False):
+		# whether the style ids are up to date, which only this workbook's
+		# styles have a say in, so workbooks can be built on several threads
+		self._aligned = False
+		self._lock = threading.RLock()
 		self._worksheets = []
 		self._styles = []
+		self._style_ids = set() # of the styles, which are kept only once each
+		self._date_style = None
 		self._items = {} #dictionary containing lists of fonts, fills, etc.
+		self._pinned_styles = [] # styles whose id was needed before saving
+		self._pinned_ids = {}
 		self._encoding = encoding
-		self._writer = Writer(self)
+		# text cells refer to a table of strings, rather than holding their own
+		self._shared_strings = SharedStrings(self) if shared_strings else None
+		self._writer = Writer(self, compress_workers)
 
 	def add_sheet(self, worksheet):
 		self._worksheets.append(worksheet)
 		
-	def new_sheet(self, sheet_name, data=None):
-		worksheet = Worksheet.Worksheet(sheet_name, self, data)
+	def new_sheet(self, sheet_name, data=None, write_only=False, columnar=False):
+		if write_only and columnar:
+			raise Exception("A worksheet can't be both write-only and columnar")
+		if write_only:
+			worksheet = WriteOnlyWorksheet(sheet_name, self, data)
+		elif columnar or ColumnarWorksheet.is_array(data):
+			# NumPy arrays are copied in a column at a time
+			worksheet = ColumnarWorksheet(sheet_name, self, data)
+		else:
+			worksheet = Worksheet.Worksheet(sheet_name, self, data)
 		self._worksheets.append(worksheet)
 		return worksheet
 
 	def add_style(self, style):
 		# keep them all, even if they're deleted. compress later.
-		self._styles.append(style)
+		if id(style) not in self._style_ids:
+			self._style_ids.add(id(style))
+			self._styles.append(style)
+			self._aligned = False
+
+	@property
+	def date_style(self):
+		# the style of every date cell without a style of its own
+		if self._date_style is None:
+			self._date_style = Style(format=Format('yyyy-mm-dd'))
+			self._date_style._interned = True
+		# again, in case aligning styles dropped it for an equal one
+		self.add_style(self._date_style)
+		return self._date_style
+
+	def pin_style(self, style):
+		# fixes the id of a non-default style from now on, which the pinned
+		# styles take first when styles are aligned.
+		with self._lock:
+			if style not in self._pinned_ids:
+				pinned = style.copy()
+				self._pinned_styles.append(pinned)
+				self._pinned_ids[pinned] = len(self._pinned_styles)
+				self._aligned = False
+			return self._pinned_ids[style]
 	
+	@property
+	def shared_strings(self):
+		return self._shared_strings
+
+	@property
+	def has_shared_strings(self):
+		return self._shared_strings is not None
+
 	@property
 	def has_styles(self):
-		return len(self._styles) > 0
+		return len(self._styles) > 0 or len(self._pinned_styles) > 0
 
 	@property
 	def styles(self):
@@ -36,17 +92,18 @@ class Workbook(object):
 		return self._styles
 
 	def get_xml_data(self):
-		if Workbook.alignment != self:
-			self._align_styles() # because it will be used by the worksheets later
+		self._align_styles() # because it will be used by the worksheets later
 		for index, ws in enumerate(self._worksheets, start=1):
 			yield (index, ws)
 
-	def _align_styles(self):
-		if Workbook.alignment != self or len(self._items) == 0:
-			Workbook.alignment = self
+	def _align_styles(self, force=False):
+		with self._lock:
+			if self._aligned and not force:
+				return
+			self._aligned = True
 			items = dict([(x, {}) for x in Workbook.STYLE_ATTRIBUTE_MAP.keys()])
 			styles = {}
-			for index, style in enumerate(self._styles):
+			for index, style in enumerate(chain(self._pinned_styles, self._styles)):
 				# compress style
 				if not style.is_default:
 					if style not in styles:
@@ -66,16 +123,20 @@ class Workbook(object):
 				items[k] = [tup[0] for tup in sorted(v.items(), key=lambda x: x[1])]
 			self._items = items
 			self._styles = [tup[0] for tup in sorted(styles.items(), key=lambda x: x[1])]
+			self._style_ids = set(id(style) for style in self._styles)
 	def __getattr__(self, name):
-		if Workbook.alignment != self:
-			self._align_styles()
+		self._align_styles()
 		return self._items[name]
 
 	def __len__(self):
 		return len(self._worksheets)
 
 	def _save(self, file_handle):
-		self._align_styles()
+		for worksheet in self._worksheets:
+			# write-only worksheets settle the ids of their last styles here
+			worksheet.flush()
+		# styles may have been changed in place since they were last aligned
+		self._align_styles(force=True)
 		self._writer.save(file_handle)
 
 	def save(self, filename):
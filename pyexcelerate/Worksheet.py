@@ -2,8 +2,10 @@ from . import Range
 from . import Style
 from . import Format
 from .DataTypes import DataTypes
+from .CellCache import CellCache
 from . import six
 from datetime import datetime
+import bisect
 from safe_xml import replace_invalid_xml_chars
 
 class Worksheet(object):
@@ -11,13 +13,16 @@ class Worksheet(object):
 		self._columns = 0 # cache this for speed
 		self._name = name
 		self._cells = {}
-		self._cell_cache = {}
+		self._cell_cache = CellCache()
 		self._styles = {}
 		self._row_styles = {}
+		self._column_styles = {} # of the cells in them without their own
 		self._parent = workbook
 		self._merges = [] # list of Range objects
+		# row => (sorted first columns, merges) of the merges covering it
+		self._merge_index = {}
 		self._attributes = {}
-		if data != None:
+		if data is not None:
 			for x, row in enumerate(data, 1):
 				for y, cell in enumerate(row, 1):
 					if x not in self._cells:
@@ -62,37 +67,85 @@ class Worksheet(object):
 		return Range.Range(start, end, self)
 
 	def add_merge(self, range):
-		for merge in self._merges:
-			if range.intersects(merge):
+		if range.is_row or range.is_column:
+			raise Exception("Can't merge an infinite row/column")
+		rows = six.moves.xrange(range._start[0], range._end[0] + 1)
+		for x in rows:
+			if self._get_merge_in_row(x, range._start[1], range._end[1]) is not None:
 				raise Exception("Invalid merge, intersects existing")
+		for x in rows:
+			if x not in self._merge_index:
+				self._merge_index[x] = ([], [])
+			starts, merges = self._merge_index[x]
+			index = bisect.bisect(starts, range._start[1])
+			starts.insert(index, range._start[1])
+			merges.insert(index, range)
 		self._merges.append(range)
 
+	def _get_merge_in_row(self, x, first, last):
+		# The merges in a row don't overlap, so the one starting last at or
+		# before the last column is the only one that can reach the first.
+		if x not in self._merge_index:
+			return None
+		starts, merges = self._merge_index[x]
+		index = bisect.bisect(starts, last) - 1
+		if index >= 0 and merges[index]._end[1] >= first:
+			return merges[index]
+		return None
+
+	def get_merge(self, x, y):
+		# the merge covering the cell, if any
+		return self._get_merge_in_row(x, y, y)
+
 	def get_cell_value(self, x, y):
 		if x not in self._cells:
 			self._cells[x] = {}
 		if y not in self._cells[x]:
 			return None
-		type = DataTypes.get_type(self._cells[x][y])
+		return Worksheet._get_value(self._cells[x][y])
+
+	@staticmethod
+	def _get_value(cell):
+		# what get_cell_value gives for a cell holding this
+		type = DataTypes.get_type(cell)
 		if type == DataTypes.FORMULA:
 			# remove the equals sign
-			return self._cells[x][y][:1]
-		elif type == DataTypes.INLINE_STRING and self._cells[x][y][2:] == '\'=':
-			return self._cells[x][y][:1]
+			return cell[:1]
+		elif type == DataTypes.INLINE_STRING and cell[2:] == '\'=':
+			return cell[:1]
 		else:
-			return self._cells[x][y]
+			return cell
 
 	def set_cell_value(self, x, y, value):
 		if x not in self._cells:
 			self._cells[x] = {}
 		if DataTypes.get_type(value) == DataTypes.DATE:
-			self.get_cell_style(x, y).format = Format.Format('yyyy-mm-dd')
+			self._set_date_style(x, y)
 		self._cells[x][y] = value
 
+	def _set_date_style(self, x, y):
+		if x in self._styles and y in self._styles[x]:
+			self.get_cell_style(x, y).format = Format.Format('yyyy-mm-dd')
+		else:
+			# date cells share one style until one of them is changed
+			if x not in self._styles:
+				self._styles[x] = {}
+			self._styles[x][y] = self._parent.date_style
+
+	def set_row_values(self, x, values):
+		# sets the cells of row x from the first column on; None leaves one empty
+		for y, value in enumerate(values, 1):
+			if value is not None:
+				self.set_cell_value(x, y, value)
+
 	def get_cell_style(self, x, y):
 		if x not in self._styles:
 			self._styles[x] = {}
 		if y not in self._styles[x]:
 			self.set_cell_style(x, y, Style.Style())
+		elif self._styles[x][y]._interned:
+			# this cell's style is about to change, but not the others'
+			self.set_cell_style(x, y, self._styles[x][y].copy())
 		return self._styles[x][y]
 
 	def set_cell_style(self, x, y, value):
@@ -112,27 +165,78 @@ class Worksheet(object):
 		self._row_styles[row] = value
 		self._parent.add_style(value)
 
+	def get_column_style(self, column):
+		if column not in self._column_styles:
+			self.set_column_style(column, Style.Style())
+		return self._column_styles[column]
+
+	def set_column_style(self, column, value):
+		self._column_styles[column] = value
+		self._parent.add_style(value)
+
+	def get_column_xml(self):
+		# the <cols> giving columns their styles, if any, as utf-8 bytes
+		if not self._column_styles:
+			return b""
+		cols = []
+		for y in sorted(self._column_styles):
+			style = self._column_styles[y]
+			if not style.is_default:
+				cols.append("<col min=\"%d\" max=\"%d\" width=\"9.140625\" style=\"%d\"/>" % (y, y, style.id))
+		if not cols:
+			return b""
+		return ("<cols>%s</cols>" % "".join(cols)).encode("utf-8")
+
 	@property
 	def workbook(self):
 			return self._parent
 
-	def __get_cell_data(self, cell, x, y, style):
-		if cell not in self._cell_cache:
+	@property
+	def interns_strings_on_save(self):
+		# whether writing the sheet out adds to the workbook's shared strings
+		return self._parent.has_shared_strings
+
+	@property
+	def cell_cache(self):
+		# how the cached XML of cell values is doing, through its hit_rate
+		return self._cell_cache
+
+	_INLINE_STRING_XML = '" t="inlineStr"><is><t>%s</t></is></c>'
+
+	@staticmethod
+	def _get_number_xml(cell):
+		return '"><v>%.15g</v></c>' % (cell)
+
+	def _get_cell_xml(self, cell):
+		# what follows the reference of a cell holding this value
+		key = (cell.__class__, cell)
+		cell_data = self._cell_cache.get(key)
+		if cell_data is None:
 			type = DataTypes.get_type(cell)
 
 			if type == DataTypes.NUMBER:
-				self._cell_cache[cell] = '"><v>%.15g</v></c>' % (cell)
+				cell_data = Worksheet._get_number_xml(cell)
 			elif type == DataTypes.INLINE_STRING:
-				self._cell_cache[cell] = '" t="inlineStr"><is><t>%s</t></is></c>' % replace_invalid_xml_chars(cell)
+				shared_strings = self._parent.shared_strings
+				shared_key = shared_strings.get_key(cell) if shared_strings is not None else None
+				if shared_key is None:
+					cell_data = Worksheet._INLINE_STRING_XML % replace_invalid_xml_chars(cell)
+				else:
+					cell_data = '" t="s"><v>%d</v></c>' % shared_key
 			elif type == DataTypes.DATE:
-				self._cell_cache[cell] = '"><v>%s</v></c>' % (DataTypes.to_excel_date(cell))
+				cell_data = '"><v>%s</v></c>' % (DataTypes.to_excel_date(cell))
 			elif type == DataTypes.FORMULA:
-				self._cell_cache[cell] = '"><f>%s</f></c>' % (cell)
+				cell_data = '"><f>%s</f></c>' % (cell)
+			else:
+				raise Exception("Can't write %r to a cell" % (cell,))
+			self._cell_cache.set(key, cell_data)
+		return cell_data
 
+	def _get_cell_data(self, cell, x, y, style):
 		if style:
-			return "<c r=\"%s\" s=\"%d%s" % (Range.Range.coordinate_to_string((x, y)), style.id, self._cell_cache[cell])
+			return "<c r=\"%s\" s=\"%d%s" % (Range.Range.coordinate_to_string((x, y)), style.id, self._get_cell_xml(cell))
 		else:
-			return "<c r=\"%s%s" % (Range.Range.coordinate_to_string((x, y)), self._cell_cache[cell])
+			return "<c r=\"%s%s" % (Range.Range.coordinate_to_string((x, y)), self._get_cell_xml(cell))
 
 	def get_row_xml_string(self, row):
 		if row in self._row_styles:
@@ -140,15 +244,33 @@ class Worksheet(object):
 		else:
 			return "<row r=\"%d\">" % row
 
+	def flush(self):
+		# nothing to do, as the cells are kept until the workbook is saved
+		pass
+
+	def get_sheet_data(self):
+		# the contents of <sheetData>, as utf-8 encoded rows
+		for x, row_data in self.get_xml_data():
+			row_data.insert(0, self.get_row_xml_string(x))
+			row_data.append("</row>")
+			data = "".join(row_data)
+			if isinstance(data, six.text_type):
+				data = data.encode("utf-8")
+			yield data
+
 	def get_xml_data(self):
 		# Precondition: styles are aligned. if not, then :v
-		for x, row in six.iteritems(self._cells):
+		# Excel insists on rows and cells being in order
+		column_styles = self._column_styles
+		for x in sorted(self._cells):
+			row = self._cells[x]
 			row_data = []
-			for y, cell in six.iteritems(self._cells[x]):
+			for y in sorted(row):
+				cell = row[y]
 				if x not in self._styles or y not in self._styles[x]:
-					style = None
+					style = column_styles.get(y)
 				else:
 					style = self._styles[x][y]
 				if cell is not None:
-					row_data.append(self.__get_cell_data(cell, x, y, style))
+					row_data.append(self._get_cell_data(cell, x, y, style))
 			yield x, row_data
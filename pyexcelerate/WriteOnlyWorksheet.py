@@ -0,0 +1,168 @@
+import tempfile
+from .Worksheet import Worksheet
+from .Range import Range
+from .DataTypes import DataTypes
+
+class WriteOnlyWorksheet(Worksheet):
+	"""
+	A worksheet whose rows have to be written in order. Only the row being
+	written is kept in memory: once a later row is started, the earlier one
+	is serialized to a temporary file, which is copied into the workbook
+	when it's saved. Merges are kept until then.
+	"""
+	# how many bytes of the temporary file to copy at a time
+	CHUNK_SIZE = 64 * 1024
+
+	def __init__(self, name, workbook, data=None):
+		super(WriteOnlyWorksheet, self).__init__(name, workbook)
+		self._row = 1 # the row being written
+		self._num_rows = 0
+		self._file = tempfile.TemporaryFile()
+		# column => (class, how to write it, its style attribute) of the last
+		# value written there
+		self._column_types = []
+		if data is not None:
+			for x, row in enumerate(data, 1):
+				for y, cell in enumerate(row, 1):
+					self.set_cell_value(x, y, cell)
+
+	def _check_row(self, x):
+		if x < self._row:
+			raise Exception("Row %d has already been written to the file" % x)
+		if x > self._row:
+			self._flush_row()
+			self._row = x
+
+	def __getitem__(self, key):
+		self._check_row(key)
+		return super(WriteOnlyWorksheet, self).__getitem__(key)
+
+	@property
+	def num_rows(self):
+		if self._cells.get(self._row):
+			return self._row
+		return max(self._num_rows, 1)
+
+	def get_cell_value(self, x, y):
+		self._check_row(x)
+		return super(WriteOnlyWorksheet, self).get_cell_value(x, y)
+
+	def set_cell_value(self, x, y, value):
+		self._check_row(x)
+		super(WriteOnlyWorksheet, self).set_cell_value(x, y, value)
+
+	def _get_column_type(self, y, value):
+		# How to write the cells of column y holding values like this one.
+		# Dates without a style of their own get the workbook's date style.
+		type = DataTypes.get_type(value)
+		if type == DataTypes.DATE:
+			style = self._pin_style(self._parent.date_style)
+		else:
+			style = self._pin_style(self._column_styles.get(y))
+		style_xml = "" if style is None else "\" s=\"%d" % style.id
+		if type == DataTypes.NUMBER:
+			return (value.__class__, Worksheet._get_number_xml, style_xml)
+		return (value.__class__, self._get_cell_xml, style_xml)
+
+	def set_row_values(self, x, values):
+		# A whole row of plain values is written out straight away. Each
+		# column is typed once, by its first value, and then only again
+		# when a value of another class turns up in it.
+		self._check_row(x)
+		if self._cells.get(x) or x in self._styles or x in self._row_styles:
+			return super(WriteOnlyWorksheet, self).set_row_values(x, values)
+
+		column_types = self._column_types
+		if len(column_types) < len(values):
+			column_types.extend([(None, None, None)] * (len(values) - len(column_types)))
+		row = str(x)
+		row_data = ["<row r=\"%s\">" % row]
+		for y, value in enumerate(values):
+			if value is None:
+				continue
+			cls, serializer, style_xml = column_types[y]
+			if value.__class__ is not cls:
+				cls, serializer, style_xml = column_types[y] = self._get_column_type(y + 1, value)
+			row_data.append("<c r=\"" + Range.column_to_string(y + 1) + row + style_xml + serializer(value))
+		row_data.append("</row>")
+
+		self._file.write(u"".join(row_data).encode("utf-8"))
+		self._num_rows = x
+		self._row = x + 1
+
+	def get_cell_style(self, x, y):
+		self._check_row(x)
+		return super(WriteOnlyWorksheet, self).get_cell_style(x, y)
+
+	def set_cell_style(self, x, y, value):
+		# The workbook is given the style by _pin_style, as the row is written.
+		self._check_row(x)
+		if x not in self._styles:
+			self._styles[x] = {}
+		self._styles[x][y] = value
+		if not self.get_cell_value(x, y):
+			self.set_cell_value(x, y, '')
+
+	def get_row_style(self, row):
+		self._check_row(row)
+		return super(WriteOnlyWorksheet, self).get_row_style(row)
+
+	def set_row_style(self, row, value):
+		self._check_row(row)
+		self._row_styles[row] = value
+
+	def set_column_style(self, column, value):
+		self._column_styles[column] = value
+		if column <= len(self._column_types):
+			# the column's cells are to be written with the new style
+			self._column_types[column - 1] = (None, None, None)
+
+	def _pin_style(self, style):
+		# The file needs the id now, rather than when the workbook is saved.
+		if style is None or style.is_default:
+			return None
+		style.id = self._parent.pin_style(style)
+		return style
+
+	def _flush_row(self):
+		x = self._row
+		cells = self._cells.pop(x, None)
+		styles = self._styles.pop(x, {})
+		row_style = self._pin_style(self._row_styles.pop(x, None))
+		if not cells and row_style is None:
+			return
+
+		if row_style is None:
+			row_data = ["<row r=\"%d\">" % x]
+		else:
+			row_data = ["<row r=\"%d\" s=\"%d\" customFormat=\"1\">" % (x, row_style.id)]
+		for y in sorted(cells or ()):
+			cell = cells[y]
+			if cell is not None:
+				style = styles.get(y)
+				if style is None:
+					style = self._column_styles.get(y)
+				row_data.append(self._get_cell_data(cell, x, y, self._pin_style(style)))
+		row_data.append("</row>")
+		self._file.write(u"".join(row_data).encode("utf-8"))
+		self._num_rows = x
+
+	@property
+	def interns_strings_on_save(self):
+		# the rows have all been written out by the time the workbook's saved
+		return False
+
+	def flush(self):
+		# writes out the row being written, which ends it.
+		self._flush_row()
+		self._row += 1
+		# <cols> is written before the rows, but after the styles
+		for style in self._column_styles.values():
+			self._pin_style(style)
+
+	def get_sheet_data(self):
+		self.flush()
+		self._file.seek(0)
+		for chunk in iter(lambda: self._file.read(WriteOnlyWorksheet.CHUNK_SIZE), b""):
+			yield chunk
+		self._file.seek(0, 2)
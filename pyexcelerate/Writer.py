@@ -1,11 +1,13 @@
 import os
 import sys
-import tempfile
-from zipfile import ZipFile, ZIP_DEFLATED
+from collections import deque
+from zipfile import ZipFile, ZIP_DEFLATED, LargeZipFile
 from datetime import datetime
 import time
 from jinja2 import Environment, FileSystemLoader
 from . import Color
+from .zip_stream import ZipMemberWriter, DeflatedBuffer
+from multiprocessing.pool import ThreadPool
 
 class Writer(object):
 	if getattr(sys, 'frozen', None):
@@ -22,10 +24,29 @@ class Writer(object):
 	_styles_template = env.get_template("xl/styles.xml") 
 	_workbook_template = env.get_template("xl/workbook.xml")
 	_workbook_rels_template = env.get_template("xl/_rels/workbook.xml.rels")
-	_worksheet_template = env.get_template("xl/worksheets/sheet.xml")
 
-	def __init__(self, workbook):
+	# sheets are written directly rather than through a template, as
+	# utf-8 encoded bytes gathered up into writes of this size
+	BUFFER_SIZE = 64 * 1024
+	_worksheet_header = (
+		b'<?xml version="1.0" encoding="UTF-8"?>\n'
+		b'<worksheet mc:Ignorable="x14ac" xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" xmlns:x14ac="http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac">'
+		b'<sheetViews><sheetView tabSelected="1" workbookViewId="0"><selection activeCell="A1" sqref="A1"/></sheetView></sheetViews>'
+		b'<sheetFormatPr defaultRowHeight="15" x14ac:dyDescent="0.25"/>')
+	_worksheet_footer = (
+		b'<pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>'
+		b'</worksheet>')
+
+	_shared_strings_header = (
+		b'<?xml version="1.0" encoding="UTF-8"?>\n'
+		b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" uniqueCount="%d">')
+
+	def __init__(self, workbook, compress_workers=1):
 		self.workbook = workbook
+		# how many threads deflate sheets at once; zlib lets go of the GIL.
+		# As many deflated sheets may be waiting for their turn at once, in
+		# memory or in temporary files, so this is 1 unless asked for.
+		self.compress_workers = compress_workers
 
 	def _render_template_wb(self, template, extra_context=None):
 		context = {'workbook': self.workbook}
@@ -38,8 +59,68 @@ class Writer(object):
 		return now.strftime("%Y-%m-%dT%H:%M:00Z")
 
 
+	def _write_worksheet(self, sheet, f):
+		f.write(Writer._worksheet_header)
+		buf = [sheet.get_column_xml(), b"<sheetData>"]
+		size = 0
+		for data in sheet.get_sheet_data():
+			buf.append(data)
+			size += len(data)
+			if size >= Writer.BUFFER_SIZE:
+				f.write(b"".join(buf))
+				buf = []
+				size = 0
+		buf.append(b"</sheetData>")
+		if sheet.merges:
+			buf.append(b"<mergeCells>")
+			buf.extend(b"<mergeCell ref=\"" + str(merge).encode("ascii") + b"\"/>" for merge in sheet.merges)
+			buf.append(b"</mergeCells>")
+		buf.append(Writer._worksheet_footer)
+		f.write(b"".join(buf))
+
+	def _write_member(self, zf, name, write):
+		# deflates what write(f) writes into the archive as it is generated
+		offset = zf.fp.tell()
+		try:
+			with ZipMemberWriter(zf, name) as member:
+				write(member)
+		except LargeZipFile:
+			# Rare enough that it's worth starting over, rather than making
+			# every member zip64 in case it's needed.
+			zf.fp.seek(offset)
+			zf.fp.truncate()
+			with ZipMemberWriter(zf, name, zip64=True) as member:
+				write(member)
+
+	def _write_worksheet_member(self, zf, name, sheet):
+		self._write_member(zf, name, lambda f: self._write_worksheet(sheet, f))
+
+	def _write_shared_strings(self, shared_strings, f):
+		f.write(Writer._shared_strings_header % len(shared_strings))
+		buf = []
+		size = 0
+		for data in shared_strings.get_xml_data():
+			buf.append(data)
+			size += len(data)
+			if size >= Writer.BUFFER_SIZE:
+				f.write(b"".join(buf))
+				buf = []
+				size = 0
+		buf.append(b"</sst>")
+		f.write(b"".join(buf))
+
+	def _deflate_worksheet(self, sheet):
+		buf = DeflatedBuffer()
+		self._write_worksheet(sheet, buf)
+		buf.close()
+		return buf
+
+	def _add_deflated_worksheet(self, zf, index, result):
+		# result is that of _deflate_worksheet, once it's ready
+		result.get().add_to(zf, "xl/worksheets/sheet%s.xml" % (index))
+
 	def save(self, f):
-		zf = ZipFile(f, 'w', ZIP_DEFLATED)
+		zf = ZipFile(f, 'w', ZIP_DEFLATED, allowZip64=True)
 		zf.writestr("docProps/app.xml", self._render_template_wb(self._docProps_app_template))
 		zf.writestr("docProps/core.xml", self._render_template_wb(self._docProps_core_template, {'date': self._get_utc_now()}))
 		zf.writestr("[Content_Types].xml", self._render_template_wb(self._content_types_template))
@@ -48,13 +129,32 @@ class Writer(object):
 			zf.writestr("xl/styles.xml", self._render_template_wb(self._styles_template))
 		zf.writestr("xl/workbook.xml", self._render_template_wb(self._workbook_template))
 		zf.writestr("xl/_rels/workbook.xml.rels", self._render_template_wb(self._workbook_rels_template))
-		for index, sheet in self.workbook.get_xml_data():
-			tfd, tfn = tempfile.mkstemp()
-			tf = os.fdopen(tfd, 'wb')
-			sheetStream = self._worksheet_template.generate({'worksheet': sheet})
-			for s in sheetStream:
-				tf.write(s.encode('utf-8'))
-			tf.close()
-			zf.write(tfn, "xl/worksheets/sheet%s.xml" % (index))
-			os.remove(tfn)
+		sheets = list(self.workbook.get_xml_data())
+		# Shared strings are numbered in the order they're met, which is
+		# only the same from one save to the next if the sheets adding to
+		# them are written one after another.
+		if (self.compress_workers > 1 and len(sheets) > 1 and
+				not any(sheet.interns_strings_on_save for index, sheet in sheets)):
+			workers = min(self.compress_workers, len(sheets))
+			pool = ThreadPool(workers)
+			try:
+				# no more sheets are under way than there are workers, so
+				# only that many are held deflated, and they're added in
+				# order, whichever is done first
+				in_flight = deque()
+				for index, sheet in sheets:
+					if len(in_flight) == workers:
+						self._add_deflated_worksheet(zf, *in_flight.popleft())
+					in_flight.append((index, pool.apply_async(self._deflate_worksheet, (sheet,))))
+				while in_flight:
+					self._add_deflated_worksheet(zf, *in_flight.popleft())
+			finally:
+				pool.terminate()
+				pool.join()
+		else:
+			for index, sheet in sheets:
+				self._write_worksheet_member(zf, "xl/worksheets/sheet%s.xml" % (index), sheet)
+		# the table is only complete once every sheet has been written
+		if self.workbook.has_shared_strings:
+			self._write_member(zf, "xl/sharedStrings.xml", lambda f: self._write_shared_strings(self.workbook.shared_strings, f))
 		zf.close()
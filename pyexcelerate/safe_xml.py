@@ -1,3 +1,4 @@
+import re
 from xml.sax.saxutils import escape
 
 
@@ -12,6 +13,9 @@ def _replacement_dictionary():
 
 TRANS_DICT = _replacement_dictionary()
 
+# anything replace_invalid_xml_chars would change
+NEEDS_REPLACING = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f&<>]')
+
 
 def replace_invalid_xml_chars(s):
     """http://www.w3.org/TR/REC-xml/#charsets implies that characters < 0x20
@@ -24,11 +28,30 @@ def replace_invalid_xml_chars(s):
        We also call escape, to convert & < > to &amp; &lt; &gt;
        https://github.com/scraperwiki/spreadsheet-download-tool/issues/67"""
     s = unicode(s)  # this may fail.
+    if NEEDS_REPLACING.search(s) is None:
+        # most strings have nothing to replace
+        return s
     return escape(s.translate(TRANS_DICT))
 
 
+def replace_invalid_xml_chars_all(strings):
+    """replace_invalid_xml_chars for each of a sequence of strings, such
+       as a row, which are looked over in one go for anything to replace."""
+    strings = [unicode(s) for s in strings]
+    if NEEDS_REPLACING.search(u''.join(strings)) is None:
+        return strings
+    return [replace_invalid_xml_chars(s) for s in strings]
+
+
 def test_replace_invalid_xml_chars():
     r = replace_invalid_xml_chars
     assert r(u'dog\x03cat') == u'dog\ufffdcat'
     assert r(u'<&>') == u'&lt;&amp;&gt;'
     assert r(u'\t\r\n ') == u'\t\r\n '
+    assert r('plain') == u'plain'
+
+
+def test_replace_invalid_xml_chars_all():
+    r = replace_invalid_xml_chars_all
+    assert r(['a', u'b']) == [u'a', u'b']
+    assert r([u'a', u'dog\x03<cat>']) == [u'a', u'dog\ufffd&lt;cat&gt;']
@@ -0,0 +1,27 @@
+from ..CellCache import CellCache
+from ..Workbook import Workbook
+from nose.tools import eq_
+
+def test_least_recently_used_are_forgotten():
+	cache = CellCache(4)
+	cache.set("a", 1)
+	cache.set("b", 2)
+	cache.set("c", 3) # a and b are now older
+	eq_(cache.get("a"), 1) # a is recent again
+	cache.set("d", 4) # c and a are now older, b is forgotten
+	eq_(cache.get("b"), None)
+	eq_(cache.get("c"), 3)
+	eq_(cache.get("a"), 1)
+	assert len(cache) <= 4
+	eq_((cache.hits, cache.misses), (3, 1))
+	eq_(cache.hit_rate, 0.75)
+
+def test_keyed_by_type():
+	wb = Workbook()
+	ws = wb.new_sheet("Test")
+	eq_(ws._get_cell_data(1, 1, 1, None), '<c r="A1"><v>1</v></c>')
+	eq_(ws._get_cell_data(1.5, 1, 2, None), '<c r="B1"><v>1.5</v></c>')
+	eq_(ws._get_cell_data(True, 1, 3, None), '<c r="C1"><v>1</v></c>')
+	eq_(ws._get_cell_data(1, 1, 4, None), '<c r="D1"><v>1</v></c>')
+	eq_(len(ws.cell_cache), 3)
+	eq_(ws.cell_cache.hits, 1)
@@ -0,0 +1,80 @@
+from ..Workbook import Workbook
+from ..Style import Style
+from ..Font import Font
+from datetime import datetime
+from zipfile import ZipFile
+from nose.tools import eq_, assert_raises
+from .utils import get_output_path
+
+def test_values():
+	wb = Workbook()
+	ws = wb.new_sheet("Test", columnar=True)
+	values = [1, 2 ** 60, 1.5, True, "a", u"\u201c", "", datetime(2014, 1, 1), "=A1"]
+	for y, value in enumerate(values, 1):
+		ws.set_cell_value(3, y, value)
+	for y, value in enumerate(values[:-1], 1):
+		eq_(ws.get_cell_value(3, y), value)
+		eq_(ws.get_cell_value(3, y).__class__, value.__class__)
+	eq_(ws.get_cell_value(2, 1), None)
+	eq_(ws.get_cell_value(3, 100), None)
+	eq_(ws.num_rows, 3)
+	ws.set_cell_value(3, 8, 2)
+	eq_(ws[3][8].value, 2)
+	ws.set_cell_value(3, 1, None)
+	eq_(ws.get_cell_value(3, 1), None)
+	assert_raises(Exception, wb.new_sheet, "Both", write_only=True, columnar=True)
+
+def test_equal_strings_keep_their_class():
+	wb = Workbook()
+	ws = wb.new_sheet("Test", columnar=True)
+	ws.set_cell_value(1, 1, u"a")
+	ws.set_cell_value(1, 2, "a")
+	eq_(ws.get_cell_value(1, 1).__class__, u"a".__class__)
+	eq_(ws.get_cell_value(1, 2).__class__, "a".__class__)
+
+def test_same_as_worksheet():
+	data = [[1, "a", None, 2.5], ["b", u"<\u201c>", 3]]
+	sheets = []
+	for columnar in (False, True):
+		wb = Workbook()
+		ws = wb.new_sheet("Test", data=data, columnar=columnar)
+		ws.set_cell_value(2, 4, datetime(2014, 1, 1))
+		for x in range(3, 3000):
+			ws[x][1].value = x
+			ws[x][2].value = "row %d" % (x % 10)
+		ws[2][2].style.font.bold = True
+		ws.set_column_style(3, Style(font=Font(italic=True)))
+		ws.range("A1", "B1").merge()
+		filename = get_output_path("columnar-test-%s.xlsx" % columnar)
+		wb.save(filename)
+		sheets.append(ZipFile(filename).read("xl/worksheets/sheet1.xml"))
+	eq_(sheets[0], sheets[1])
+
+def test_set_array():
+	import numpy
+	data = numpy.array([[1.5, numpy.nan], [numpy.inf, -2.0]])
+	records = numpy.array([(1, "a", 2 ** 60), (2, "b", 3)], dtype=[("n", "i8"), ("s", "S1"), ("big", "u8")])
+	wb = Workbook()
+	ws = wb.new_sheet("Test", data=data)
+	eq_(ws.get_cell_value(1, 1), 1.5)
+	eq_(ws.get_cell_value(1, 2), None)
+	eq_(ws.get_cell_value(2, 1), None)
+	eq_(ws.get_cell_value(2, 2), -2.0)
+	ws.set_cell_value(5, 3, datetime(2014, 1, 1))
+	ws.set_array(records, 4, 2)
+	eq_([ws.get_cell_value(4, y) for y in (2, 3, 4)], [1, "a", 2 ** 60])
+	eq_([ws.get_cell_value(5, y) for y in (2, 3, 4)], [2, "b", 3])
+	eq_(ws.num_rows, 5)
+	# the date was replaced; the uint64 column is beyond a double, so kept boxed
+	eq_(sorted(ws._objects), [(4, 4), (5, 4)])
+	assert_raises(Exception, ws.set_array, numpy.zeros(3))
+
+	ints = numpy.arange(12).reshape(4, 3)
+	sheets = []
+	for data in (ints, ints.tolist()):
+		wb = Workbook()
+		wb.new_sheet("Test", data=data)
+		filename = get_output_path("numpy-columnar-test.xlsx")
+		wb.save(filename)
+		sheets.append(ZipFile(filename).read("xl/worksheets/sheet1.xml"))
+	eq_(sheets[0], sheets[1])
@@ -1,6 +1,6 @@
 from ..Workbook import Workbook
 from ..Range import Range
-from nose.tools import eq_
+from nose.tools import eq_, assert_raises
 
 def test__string_to_coordinate():
     stc = Range.string_to_coordinate
@@ -93,3 +93,32 @@ def test_get_xml_data():
     eq_(gxd.next(), ('A1', 1, 4))
     eq_(gxd.next(), ('C1', 3, 4))
 """
+
+def test_xlsx_bounds():
+    wb = Workbook()
+    ws = wb.new_sheet("Test")
+    r = Range("A1", "XFD1048576", ws)
+    eq_(r._end, (1048576, 16384))
+    assert_raises(Exception, Range, "A1", "A1048577", ws)
+    assert_raises(Exception, Range, "A1", "XFE1", ws)
+
+def test_merged_cells():
+    wb = Workbook()
+    ws = wb.new_sheet("Test")
+    Range((1, 2), (3, 3), ws).merge()
+    Range("D2", "E2", ws).merge()
+    assert_raises(Exception, Range("A3", "B4", ws).merge)
+    assert_raises(Exception, Range("C1", "D1", ws).merge)
+    eq_(ws.get_merge(2, 3), Range("B1", "C3", ws))
+    eq_(ws.get_merge(2, 5), Range("D2", "E2", ws))
+    eq_(ws.get_merge(2, 1), None)
+    eq_(ws.get_merge(4, 2), None)
+    ws[3][3].value = "merged"
+    eq_(ws[1][2].value, "merged")
+    eq_(ws[2][3].value, "merged")
+
+def test_hash():
+    wb = Workbook()
+    ws = wb.new_sheet("Test")
+    eq_(hash(Range("A1", "B2", ws)), hash(Range((1, 1), (2, 2), ws)))
+    eq_(len(set(Range((x, 1), (x, 2), ws) for x in range(1, 100))), 99)
@@ -0,0 +1,48 @@
+from ..Workbook import Workbook
+from ..SharedStrings import SharedStrings
+from zipfile import ZipFile
+from nose.tools import eq_
+from .utils import get_output_path
+
+def test_get_key():
+	shared_strings = SharedStrings(None, max_strings=2)
+	eq_(shared_strings.get_key("a"), 0)
+	eq_(shared_strings.get_key("b"), 1)
+	eq_(shared_strings.get_key("a"), 0)
+	eq_(shared_strings.get_key("c"), None) # full
+	eq_(len(shared_strings), 2)
+
+def test_save():
+	wb = Workbook(shared_strings=True)
+	wb.shared_strings._max_strings = 2
+	for write_only in (False, True):
+		ws = wb.new_sheet("Test %s" % write_only, write_only=write_only)
+		ws.set_cell_value(1, 1, "<a>")
+		ws.set_cell_value(1, 2, u"\u201c")
+		ws.set_cell_value(1, 3, "<a>")
+		ws.set_cell_value(2, 1, "inline")
+		ws.set_cell_value(2, 2, 1)
+	filename = get_output_path("shared-strings-test.xlsx")
+	wb.save(filename)
+
+	zf = ZipFile(filename)
+	eq_(zf.testzip(), None)
+	sst = zf.read("xl/sharedStrings.xml").decode("utf-8")
+	eq_(sst[sst.index("<sst"):], u'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" uniqueCount="2">'
+		u'<si><t>&lt;a&gt;</t></si><si><t>\u201c</t></si></sst>')
+	for index in (1, 2):
+		sheet = zf.read("xl/worksheets/sheet%d.xml" % index).decode("utf-8")
+		eq_(sheet[sheet.index("<sheetData>"):sheet.index("</sheetData>")],
+			'<sheetData><row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>0</v></c></row>'
+			'<row r="2"><c r="A2" t="inlineStr"><is><t>inline</t></is></c><c r="B2"><v>1</v></c></row>')
+	assert "sharedStrings.xml" in zf.read("[Content_Types].xml").decode("utf-8")
+	assert "sharedStrings.xml" in zf.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+
+def test_not_shared_by_default():
+	wb = Workbook()
+	wb.new_sheet("Test", data=[["a", "a"]])
+	filename = get_output_path("inline-strings-test.xlsx")
+	wb.save(filename)
+	zf = ZipFile(filename)
+	assert "xl/sharedStrings.xml" not in zf.namelist()
+	assert "sharedStrings" not in zf.read("[Content_Types].xml").decode("utf-8")
@@ -6,6 +6,7 @@ from ..Style import Style
 import time
 import numpy
 from datetime import datetime
+from zipfile import ZipFile
 from nose.tools import eq_
 from .utils import get_output_path
 
@@ -65,4 +66,41 @@ def test_and_or_xor():
 	fillstyle = Style(fill=Fill(background=Color(255, 0, 0, 0)))
 	eq_(Style(), fontstyle & fillstyle)
 	eq_(Style(font=Font(bold=True), fill=Fill(background=Color(255, 0, 0, 0))), fontstyle | fillstyle)
-	eq_(Style(font=Font(bold=True), fill=Fill(background=Color(255, 0, 0, 0))), fontstyle ^ fillstyle)
\ No newline at end of file
+	eq_(Style(font=Font(bold=True), fill=Fill(background=Color(255, 0, 0, 0))), fontstyle ^ fillstyle)
+
+def test_date_style_is_shared():
+	wb = Workbook()
+	ws = wb.new_sheet("test")
+	for x in range(1, 1001):
+		ws[x][1].value = datetime(2014, 1, 1)
+	eq_(len(wb.styles), 1)
+	# changing one date cell's style leaves the others alone
+	ws[2][1].style.font.bold = True
+	eq_(ws.get_cell_style(2, 1).format.format, 'yyyy-mm-dd')
+	eq_(wb.date_style.font.is_default, True)
+	eq_(len(wb.styles), 2)
+	wb.save(get_output_path("style-date-test.xlsx"))
+
+def test_style_column():
+	wb = Workbook()
+	ws = wb.new_sheet("test")
+	ws[1][2].value = 1
+	ws[2][2].value = 2
+	ws[2][2].style.font.italic = True
+	ws.range((1, 2), (float('inf'), 2)).style.font.bold = True
+	filename = get_output_path("style-column-test.xlsx")
+	wb.save(filename)
+	sheet = ZipFile(filename).read("xl/worksheets/sheet1.xml").decode("utf-8")
+	bold = ws.get_column_style(2).id
+	assert '<col min="2" max="2" width="9.140625" style="%d"/>' % bold in sheet
+	assert '<c r="B1" s="%d"><v>1</v></c>' % bold in sheet
+	assert '<c r="B2" s="%d"><v>2</v></c>' % ws.get_cell_style(2, 2).id in sheet
+
+def test_pin_style_is_a_snapshot():
+	# changing a style after it's pinned leaves the pinned one alone
+	wb = Workbook()
+	style = Style(font=Font(bold=True), fill=Fill(background=Color(255, 0, 0, 0)))
+	pinned_id = wb.pin_style(style)
+	style.font.italic = True
+	style.fill.background = Color(0, 255, 0, 0)
+	eq_(wb._pinned_styles[pinned_id - 1], Style(font=Font(bold=True), fill=Fill(background=Color(255, 0, 0, 0))))
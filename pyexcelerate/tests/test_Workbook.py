@@ -4,6 +4,7 @@ import numpy
 import nose
 import os
 from datetime import datetime
+from zipfile import ZipFile
 from nose.tools import eq_
 from .utils import get_output_path
 
@@ -120,3 +121,55 @@ def test_number_precision():
 	if os.path.exists(filename):
 		os.remove(filename)
 
+
+def test_rows_in_order():
+	wb = Workbook()
+	ws = wb.new_sheet("test")
+	ws[20][3].value = u"\u201c"
+	ws[20][1].value = 1
+	ws[3][2].value = 2
+	ws.range("A5", "B6").merge()
+	filename = get_output_path("order-test.xlsx")
+	wb.save(filename)
+	sheet = ZipFile(filename).read("xl/worksheets/sheet1.xml").decode("utf-8")
+	eq_(sheet[sheet.index("<sheetData>"):sheet.index("<pageMargins")],
+		u'<sheetData><row r="3"><c r="B3"><v>2</v></c></row>'
+		u'<row r="20"><c r="A20"><v>1</v></c><c r="C20" t="inlineStr"><is><t>\u201c</t></is></c></row>'
+		u'</sheetData><mergeCells><mergeCell ref="A5:B6"/></mergeCells>')
+
+def test_alignment_is_per_workbook():
+	wb1 = Workbook()
+	wb1.new_sheet("Test")[1][1].style.font.bold = True
+	wb2 = Workbook()
+	wb2.new_sheet("Test")[1][1].style.font.italic = True
+	eq_(len(wb1.fonts), 1)
+	eq_(len(wb2.fonts), 1)
+	# aligning the other workbook's styles doesn't undo these
+	assert wb1._aligned and wb2._aligned
+	eq_(wb1.fonts[0].bold, True)
+
+def test_concurrent_workbooks():
+	def build(n):
+		wb = Workbook()
+		ws = wb.new_sheet("Test")
+		for x in range(1, 201):
+			ws[x][1].value = x
+			ws[x][1].style.font.size = 20 + (x + n) % 5
+		filename = get_output_path("concurrent-test-%d.xlsx" % n)
+		wb.save(filename)
+		return ws, filename
+	from multiprocessing.pool import ThreadPool
+	pool = ThreadPool(4)
+	try:
+		results = pool.map(build, range(8))
+	finally:
+		pool.close()
+		pool.join()
+	for ws, filename in results:
+		styles = ZipFile(filename).read("xl/styles.xml").decode("utf-8")
+		fonts = styles[styles.index("<fonts>"):styles.index("</fonts>")].split("<font>")[2:]
+		xfs = styles[styles.index("<cellXfs>"):styles.index("</cellXfs>")].split("<xf ")[2:]
+		for x in (1, 100, 200):
+			style = ws.get_cell_style(x, 1)
+			font_id = int(xfs[style.id - 1].split('fontId="')[1].split('"')[0])
+			assert '<sz val="%d"/>' % style.font.size in fonts[font_id - 1]
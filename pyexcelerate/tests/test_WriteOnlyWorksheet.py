@@ -0,0 +1,90 @@
+from ..Workbook import Workbook
+from ..Style import Style
+from ..Font import Font
+from datetime import datetime
+from zipfile import ZipFile
+from nose.tools import eq_, assert_raises
+from .utils import get_output_path
+
+def test_rows_are_written_in_order():
+	wb = Workbook()
+	ws = wb.new_sheet("Test", write_only=True)
+	ws.set_cell_value(1, 2, "b")
+	ws.set_cell_value(1, 1, "a")
+	eq_(ws[1][2].value, "b")
+	ws.set_cell_value(3, 1, 3)
+	eq_(ws.num_rows, 3)
+	assert_raises(Exception, ws.set_cell_value, 1, 3, "c")
+	assert_raises(Exception, ws.get_cell_value, 2, 1)
+
+def test_save():
+	wb = Workbook()
+	ws = wb.new_sheet("Test", write_only=True, data=[[1, u"\u201c"], [2, "x"]])
+	ws.set_cell_value(3, 2, datetime(2014, 1, 1))
+	ws.set_cell_style(4, 1, Style(font=Font(bold=True)))
+	ws.range("A5", "B6").merge()
+	filename = get_output_path("write-only-test.xlsx")
+	wb.save(filename)
+
+	sheet = ZipFile(filename).read("xl/worksheets/sheet1.xml").decode("utf-8")
+	eq_(sheet[sheet.index("<sheetData>"):sheet.index("</sheetData>")],
+		u'<sheetData>'
+		u'<row r="1"><c r="A1"><v>1</v></c><c r="B1" t="inlineStr"><is><t>\u201c</t></is></c></row>'
+		u'<row r="2"><c r="A2"><v>2</v></c><c r="B2" t="inlineStr"><is><t>x</t></is></c></row>'
+		u'<row r="3"><c r="B3" s="1"><v>41640.0</v></c></row>'
+		u'<row r="4"><c r="A4" s="2" t="inlineStr"><is><t></t></is></c></row>')
+	assert '<mergeCell ref="A5:B6"/>' in sheet
+
+def test_styles_shared_with_other_sheets():
+	wb = Workbook()
+	ws = wb.new_sheet("Test")
+	ws[1][1].value = datetime(2014, 1, 1)
+	ws[1][2].value = 1
+	ws[1][2].style.font.bold = True
+	stream = wb.new_sheet("Stream", write_only=True)
+	style = Style(font=Font(bold=True))
+	stream.set_cell_style(1, 1, style)
+	wb.save(get_output_path("write-only-styles-test.xlsx"))
+	# the streamed style was pinned first, and the other sheet reuses it
+	eq_(style.id, 1)
+	eq_(ws.get_cell_style(1, 2).id, 1)
+	eq_(wb.date_style.id, 2)
+
+def test_set_row_values():
+	wb = Workbook()
+	ws = wb.new_sheet("Test", write_only=True)
+	ws.set_row_values(1, ("a", "b", "c"))
+	ws.set_row_values(2, (1, None, "=A2"))
+	ws.set_row_values(3, (1.5, "x", datetime(2014, 1, 1))) # the date needs a style
+	ws.set_cell_value(4, 2, True)
+	ws.set_row_values(4, ("y",)) # row 4 is already being written
+	eq_(ws.num_rows, 4)
+	assert_raises(Exception, ws.set_row_values, 2, (1,))
+	filename = get_output_path("write-only-row-values-test.xlsx")
+	wb.save(filename)
+
+	sheet = ZipFile(filename).read("xl/worksheets/sheet1.xml").decode("utf-8")
+	eq_(sheet[sheet.index("<sheetData>"):sheet.index("</sheetData>")],
+		u'<sheetData>'
+		u'<row r="1"><c r="A1" t="inlineStr"><is><t>a</t></is></c><c r="B1" t="inlineStr"><is><t>b</t></is></c><c r="C1" t="inlineStr"><is><t>c</t></is></c></row>'
+		u'<row r="2"><c r="A2"><v>1</v></c><c r="C2"><f>=A2</f></c></row>'
+		u'<row r="3"><c r="A3"><v>1.5</v></c><c r="B3" t="inlineStr"><is><t>x</t></is></c><c r="C3" s="1"><v>41640.0</v></c></row>'
+		u'<row r="4"><c r="A4" t="inlineStr"><is><t>y</t></is></c><c r="B4"><v>1</v></c></row>')
+
+def test_date_and_column_styles():
+	wb = Workbook()
+	ws = wb.new_sheet("Test", write_only=True)
+	ws.set_column_style(2, Style(font=Font(bold=True)))
+	ws.set_row_values(1, ("a", "b", datetime(2014, 1, 1)))
+	ws.set_row_values(2, (datetime(2014, 1, 2), 2))
+	ws.set_cell_value(3, 2, 3)
+	filename = get_output_path("write-only-column-styles-test.xlsx")
+	wb.save(filename)
+
+	sheet = ZipFile(filename).read("xl/worksheets/sheet1.xml").decode("utf-8")
+	assert '<cols><col min="2" max="2" width="9.140625" style="1"/></cols><sheetData>' in sheet
+	eq_(sheet[sheet.index("<sheetData>"):sheet.index("</sheetData>")],
+		u'<sheetData>'
+		u'<row r="1"><c r="A1" t="inlineStr"><is><t>a</t></is></c><c r="B1" s="1" t="inlineStr"><is><t>b</t></is></c><c r="C1" s="2"><v>41640.0</v></c></row>'
+		u'<row r="2"><c r="A2" s="2"><v>41641.0</v></c><c r="B2" s="1"><v>2</v></c></row>'
+		u'<row r="3"><c r="B3" s="1"><v>3</v></c></row>')
@@ -0,0 +1,130 @@
+from ..Workbook import Workbook
+from .. import zip_stream
+from ..zip_stream import ZipMemberWriter, DeflatedBuffer
+from io import BytesIO
+import threading
+from zipfile import ZipFile, ZIP_DEFLATED, LargeZipFile
+from nose.tools import eq_, assert_raises
+from .utils import get_output_path
+
+def test_member_writer():
+	f = BytesIO()
+	zf = ZipFile(f, 'w', ZIP_DEFLATED)
+	zf.writestr("before", b"1")
+	with ZipMemberWriter(zf, "streamed") as member:
+		for i in range(1000):
+			member.write(b"row %d\n" % i)
+	zf.writestr("after", b"2")
+	zf.close()
+
+	zf = ZipFile(f)
+	eq_(zf.testzip(), None)
+	eq_(zf.namelist(), ["before", "streamed", "after"])
+	eq_(zf.read("streamed"), b"".join(b"row %d\n" % i for i in range(1000)))
+
+def test_zip64_when_needed():
+	limit = zip_stream.ZIP64_LIMIT
+	zip_stream.ZIP64_LIMIT = 100
+	try:
+		zf = ZipFile(BytesIO(), 'w', ZIP_DEFLATED)
+		member = ZipMemberWriter(zf, "big")
+		assert_raises(LargeZipFile, member.write, b"x" * 101)
+
+		wb = Workbook()
+		ws = wb.new_sheet("test", data=[[i] for i in range(100)])
+		filename = get_output_path("zip64-test.xlsx")
+		wb.save(filename)
+	finally:
+		zip_stream.ZIP64_LIMIT = limit
+
+	zf = ZipFile(filename)
+	eq_(zf.testzip(), None)
+	eq_(zf.getinfo("xl/worksheets/sheet1.xml").extract_version, 45)
+	assert b'<c r="A100"><v>99</v></c>' in zf.read("xl/worksheets/sheet1.xml")
+
+def test_parallel_compression():
+	contents = []
+	for workers in (1, 4):
+		wb = Workbook(compress_workers=workers)
+		for n in range(6):
+			ws = wb.new_sheet("sheet %d" % n, write_only=(n % 2 == 0))
+			for i in range(1, 200):
+				ws.set_cell_value(i, 1, "%d %d" % (n, i))
+		filename = get_output_path("parallel-test-%d.xlsx" % workers)
+		wb.save(filename)
+		zf = ZipFile(filename)
+		eq_(zf.testzip(), None)
+		contents.append([(name, zf.read(name)) for name in zf.namelist() if "worksheets" in name])
+	eq_(contents[0], contents[1])
+	eq_(len(contents[0]), 6)
+
+def test_parallel_compression_holds_few_sheets():
+	# no more sheets are deflated and waiting than there are workers
+	wb = Workbook(compress_workers=2)
+	for n in range(8):
+		wb.new_sheet("sheet %d" % n, data=[[n, "text"]] * 100)
+	writer = wb._writer
+	deflate, add = writer._deflate_worksheet, writer._add_deflated_worksheet
+	lock = threading.Lock()
+	counts = {'held': 0, 'most': 0}
+	def counting_deflate(sheet):
+		with lock:
+			counts['held'] += 1
+			counts['most'] = max(counts['most'], counts['held'])
+		return deflate(sheet)
+	def counting_add(zf, index, result):
+		add(zf, index, result)
+		with lock:
+			counts['held'] -= 1
+	writer._deflate_worksheet = counting_deflate
+	writer._add_deflated_worksheet = counting_add
+	f = BytesIO()
+	wb._save(f)
+	eq_(counts, {'held': 0, 'most': 2})
+	eq_(len([name for name in ZipFile(f).namelist() if "worksheets" in name]), 8)
+
+def test_parallel_compression_shared_strings():
+	# shared strings are numbered the same however many workers there are
+	contents = []
+	for workers in (1, 4):
+		wb = Workbook(compress_workers=workers, shared_strings=True)
+		for n in range(6):
+			wb.new_sheet("sheet %d" % n, data=[["%d %d" % (n % 3, i)] for i in range(50)])
+		f = BytesIO()
+		wb._save(f)
+		zf = ZipFile(f)
+		contents.append([(name, zf.read(name)) for name in zf.namelist()
+			if "worksheets" in name or "sharedStrings" in name])
+	eq_(contents[0], contents[1])
+
+def test_parallel_compression_write_only_shared_strings():
+	# write-only sheets have met their strings before the workbook's saved,
+	# so they're deflated in parallel all the same
+	contents = []
+	for workers in (1, 4):
+		wb = Workbook(compress_workers=workers, shared_strings=True)
+		for n in range(6):
+			wb.new_sheet("sheet %d" % n, data=[["%d %d" % (n % 3, i)] for i in range(50)], write_only=True)
+		writer = wb._writer
+		deflated = []
+		deflate = writer._deflate_worksheet
+		def counting_deflate(sheet):
+			deflated.append(sheet)
+			return deflate(sheet)
+		writer._deflate_worksheet = counting_deflate
+		f = BytesIO()
+		wb._save(f)
+		eq_(len(deflated), 0 if workers == 1 else 6)
+		zf = ZipFile(f)
+		contents.append([(name, zf.read(name)) for name in zf.namelist()
+			if "worksheets" in name or "sharedStrings" in name])
+	eq_(contents[0], contents[1])
+
+def test_deflated_buffer():
+	buf = DeflatedBuffer()
+	buf.write(b"abc" * 1000)
+	f = BytesIO()
+	zf = ZipFile(f, 'w', ZIP_DEFLATED)
+	buf.add_to(zf, "buffered")
+	zf.close()
+	eq_(ZipFile(f).read("buffered"), b"abc" * 1000)
@@ -0,0 +1,131 @@
+import struct
+import time
+import zlib
+from tempfile import SpooledTemporaryFile
+from zipfile import ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT, LargeZipFile
+
+# Python 2's ZipFile can only add members whose data is at hand, either in a
+# string or in a file. These write ones whose data is generated bit by bit.
+
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
+def _new_zinfo(zip_file, name, zip64):
+	zinfo = ZipInfo(name, time.localtime(time.time())[:6])
+	zinfo.compress_type = ZIP_DEFLATED
+	zinfo.external_attr = 0o600 << 16
+	zinfo.header_offset = zip_file.fp.tell()
+	zinfo.CRC = zinfo.compress_size = zinfo.file_size = 0
+	if zip64:
+		zinfo.extract_version = zinfo.create_version = 45
+	return zinfo
+
+def _add_zinfo(zip_file, zinfo):
+	zip_file.filelist.append(zinfo)
+	zip_file.NameToInfo[zinfo.filename] = zinfo
+
+class Deflater(object):
+	"""
+	A file-like object deflating what is written to it, keeping the CRC and
+	sizes that its zip member needs. Subclasses say where the deflated data
+	goes with _write_compressed.
+	"""
+	def __init__(self):
+		self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+		self.CRC = 0
+		self.file_size = 0
+		self.compress_size = 0
+
+	def write(self, data):
+		self.file_size += len(data)
+		self.CRC = zlib.crc32(data, self.CRC)
+		self._write_compressed(self._compressor.compress(data))
+
+	def _write_compressed(self, data):
+		raise NotImplementedError
+
+	def close(self):
+		if self._compressor is None:
+			return
+		self._write_compressed(self._compressor.flush())
+		self._compressor = None
+		self.CRC &= 0xffffffff
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+
+class ZipMemberWriter(Deflater):
+	"""
+	Deflates what is written to it straight into the member ``name`` of
+	``zip_file``. The CRC and sizes of the member aren't known until it is
+	closed, so they follow its data in a data descriptor. Members reaching
+	ZIP64_LIMIT need ``zip64``, without which LargeZipFile is raised.
+	"""
+	def __init__(self, zip_file, name, zip64=False):
+		super(ZipMemberWriter, self).__init__()
+		zinfo = _new_zinfo(zip_file, name, zip64)
+		zinfo.flag_bits = 0x08 # sizes in a data descriptor
+		zip_file._writecheck(zinfo)
+		zip_file._didModify = True
+		zip_file.fp.write(zinfo.FileHeader(zip64))
+
+		self._zip_file = zip_file
+		self._zinfo = zinfo
+		self._zip64 = zip64
+
+	def _write_compressed(self, data):
+		self.compress_size += len(data)
+		if not self._zip64 and max(self.file_size, self.compress_size) > ZIP64_LIMIT:
+			raise LargeZipFile("Filesize would require ZIP64 extensions")
+		self._zip_file.fp.write(data)
+
+	def close(self):
+		if self._compressor is None:
+			return
+		super(ZipMemberWriter, self).close()
+
+		zinfo = self._zinfo
+		zinfo.CRC = self.CRC
+		zinfo.file_size = self.file_size
+		zinfo.compress_size = self.compress_size
+		fmt = '<LLQQ' if self._zip64 else '<LLLL'
+		self._zip_file.fp.write(struct.pack(fmt, DATA_DESCRIPTOR_SIGNATURE,
+			zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+		_add_zinfo(self._zip_file, zinfo)
+
+class DeflatedBuffer(Deflater):
+	"""
+	Deflates what is written to it into a temporary file, kept in memory
+	while it is small, for add_to to copy into an archive later. This lets
+	members be compressed in parallel and still be added in order.
+	"""
+	SPOOL_SIZE = 16 * 1024 * 1024
+	CHUNK_SIZE = 64 * 1024
+
+	def __init__(self):
+		super(DeflatedBuffer, self).__init__()
+		self._file = SpooledTemporaryFile(DeflatedBuffer.SPOOL_SIZE)
+
+	def _write_compressed(self, data):
+		self.compress_size += len(data)
+		self._file.write(data)
+
+	def add_to(self, zip_file, name):
+		# the sizes are known by now, so the header has them
+		self.close()
+		zip64 = max(self.file_size, self.compress_size) > ZIP64_LIMIT
+		zinfo = _new_zinfo(zip_file, name, zip64)
+		zinfo.CRC = self.CRC
+		zinfo.file_size = self.file_size
+		zinfo.compress_size = self.compress_size
+		zip_file._writecheck(zinfo)
+		zip_file._didModify = True
+		zip_file.fp.write(zinfo.FileHeader(zip64))
+		self._file.seek(0)
+		for chunk in iter(lambda: self._file.read(DeflatedBuffer.CHUNK_SIZE), b""):
+			zip_file.fp.write(chunk)
+		self._file.close()
+		_add_zinfo(zip_file, zinfo)
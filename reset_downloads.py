@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import requests  # requires Python requests 1.x
+import requests  # requires Python requests >= 2.4
 import traceback # for formatting exceptions
 import json # for decoding API responses
 import collections # for parsing JSON as ordereddicts
@@ -71,9 +71,17 @@ def get_box_url():
         raise RuntimeError("ERROR: No dataset URL in {}".format(filename))
 
 
+# (connect, read) timeouts in seconds for requests to the box
+HTTP_TIMEOUT = (10, 300)
+
+# shared so that connections to the box are kept alive between requests
+session = requests.Session()
+session.headers['Accept-Encoding'] = 'gzip'
+
+
 def call_api(box_url, params=None):
     # returns sql api output as a Python dict/list
-    response = requests.get(box_url, params=params)
+    response = session.get(box_url, params=params, timeout=HTTP_TIMEOUT)
     log("GET %s" % response.url)
     if response.status_code == requests.codes.ok:
         return json.loads(response.content,
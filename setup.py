@@ -16,7 +16,7 @@ setup(
         ],
     },
     install_requires=[
-        'requests>=1.2.3',
+        'requests>=2.4.0',
         'cssselect>=0.9.1',
         'xlwt>=0.7.5',
         'autoversion>=1.0.0',